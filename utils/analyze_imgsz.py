@@ -1,126 +1,332 @@
 import os
 from pathlib import Path
-import statistics
-import math
+from concurrent.futures import ThreadPoolExecutor
+import random
+import struct
+import numpy as np
 from PIL import Image
 
+IMG_EXTS = {'.jpg', '.jpeg', '.png'}
+PERCENTILES = (5, 25, 50, 75, 95)
+# Bordes (en píxeles) de los histogramas 2D de ancho x alto: potencias de 2
+SIZE_BINS = np.array([0, 8, 16, 32, 64, 128, 256, 512, 1024, 1e9])
+# Tamaños de entrada que evalúa optimize_imgsz (múltiplos de 32, el stride máximo de YOLO)
+CANDIDATE_IMGSZ = (320, 416, 512, 640, 768, 1024, 1280)
 
-def gather_bbox_stats(images_dir, labels_dir, sample_limit=None):
-    heights = []
-    widths = []
-    areas = []
-    counts = 0
+# Marcadores SOF de JPEG (los que llevan el tamaño de la imagen)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
 
-    exts = ['*.jpg', '*.jpeg', '*.png']
-    img_paths = []
-    for e in exts:
-        img_paths.extend(list[Path](Path(images_dir).glob(e)))
-    if sample_limit:
-        img_paths = img_paths[:sample_limit]
 
-    for img_path in img_paths:
+def image_size(path):
+    """(ancho, alto) leyendo solo la cabecera del archivo (PNG y JPEG); PIL para el resto."""
+    try:
+        size = _header_size(path)
+        if size is not None:
+            return size
+        with Image.open(path) as im:
+            return im.size
+    except Exception:
+        return None
+
+
+def _header_size(path):
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(26)
+            if head[:8] == b'\x89PNG\r\n\x1a\n':
+                w, h = struct.unpack('>II', head[16:24])
+                return w, h
+            if head[:2] == b'\xff\xd8':
+                f.seek(2)
+                while True:
+                    byte = f.read(1)
+                    while byte and byte != b'\xff':
+                        byte = f.read(1)
+                    while byte == b'\xff':
+                        byte = f.read(1)
+                    if not byte:
+                        break
+                    marker = byte[0]
+                    length = struct.unpack('>H', f.read(2))[0]
+                    if marker in _JPEG_SOF:
+                        h, w = struct.unpack('>xHH', f.read(5))
+                        return w, h
+                    f.seek(length - 2, 1)
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+def reservoir_sample(items, k, seed=0):
+    """Muestra uniforme de k elementos de un iterable de longitud desconocida, en una pasada (algoritmo R)."""
+    rng = random.Random(seed)
+    sample = []
+    for n, item in enumerate(items):
+        if n < k:
+            sample.append(item)
+        else:
+            j = rng.randint(0, n)
+            if j < k:
+                sample[j] = item
+    return sample
+
+
+def _parse_label(lbl_path):
+    """Cajas (clase, x, y, w, h) de un archivo como array float32 (k, 5)."""
+    try:
+        data = Path(lbl_path).read_bytes()
+    except OSError:
+        return None
+    try:
+        # El total de valores no basta (líneas de 6 y 4 columnas también suman un múltiplo de 5): se mira cada línea
+        if all(len(line.split()) == 5 for line in data.splitlines() if line.strip()):
+            return np.array(data.split(), dtype=np.float32).reshape(-1, 5)
+    except ValueError:
+        pass
+    # Formato irregular: se toman las 5 primeras columnas de cada línea válida, como antes
+    rows = []
+    for line in data.decode(errors='ignore').splitlines():
+        parts = line.split()
+        if len(parts) < 5:
+            continue
         try:
-            with Image.open(img_path) as im:
-                W, H = im.size
-        except Exception as e:
+            rows.append([float(v) for v in parts[:5]])
+        except ValueError:
             continue
+    return np.array(rows, dtype=np.float32).reshape(-1, 5)
 
-        lbl = Path(labels_dir) / (img_path.stem + ".txt")
-        if not lbl.exists():
-            continue
 
-        with open(lbl, 'r') as f:
-            for line in f:
-                parts = line.strip().split()
-                if len(parts) < 5:
-                    continue
-                try:
-                    _, x, y, w, h = map(float, parts[:5])
-                except ValueError:
-                    continue
-                bw = w * W
-                bh = h * H
-                ba = bw * bh
-                widths.append(bw)
-                heights.append(bh)
-                areas.append(ba)
-                counts += 1
+def _read_pair(item):
+    img_path, lbl_path = item
+    size = image_size(img_path)
+    if size is None:
+        return None
+    boxes = _parse_label(lbl_path)
+    if boxes is None:
+        return None
+    return size, boxes
+
+
+def gather_bbox_stats(images_dir, labels_dir, sample_limit=None, workers=8, seed=0):
+    """Tamaños de todas las cajas de un split como columnas NumPy.
+
+    Las etiquetas se leen en un pool de hilos y el tamaño de cada imagen sale
+    de su cabecera. Con sample_limit se analiza una muestra uniforme de ese
+    número de imágenes (muestreo de reservorio mientras se lista la carpeta).
+    Devuelve un dict con 'count' y arrays de una fila por caja: 'cls',
+    'widths', 'heights', 'areas' (en píxeles) e 'img_w', 'img_h'.
+    """
+    def pairs():
+        if not os.path.isdir(images_dir):
+            return
+        for entry in os.scandir(images_dir):
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMG_EXTS:
+                lbl = os.path.join(labels_dir, os.path.splitext(entry.name)[0] + '.txt')
+                yield entry.path, lbl
+
+    items = reservoir_sample(pairs(), sample_limit, seed) if sample_limit else list(pairs())
+    items = [item for item in items if os.path.exists(item[1])]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = [r for r in pool.map(_read_pair, items) if r is not None]
 
+    if results:
+        boxes = np.concatenate([b for _, b in results])
+        counts = [len(b) for _, b in results]
+        img_w = np.repeat(np.array([s[0] for s, _ in results], dtype=np.float32), counts)
+        img_h = np.repeat(np.array([s[1] for s, _ in results], dtype=np.float32), counts)
+    else:
+        boxes = np.empty((0, 5), dtype=np.float32)
+        img_w = img_h = np.empty(0, dtype=np.float32)
+
+    widths = boxes[:, 3] * img_w
+    heights = boxes[:, 4] * img_h
     return {
-        'count': counts,
+        'count': len(boxes),
+        'images': len(results),
+        'cls': boxes[:, 0].astype(np.int32),
         'widths': widths,
         'heights': heights,
-        'areas': areas
+        'areas': widths * heights,
+        'img_w': img_w,
+        'img_h': img_h,
     }
 
+def concat_stats(stats):
+    """Une las columnas de varios gather_bbox_stats (por ejemplo, de varios splits)."""
+    keys = ('cls', 'widths', 'heights', 'areas', 'img_w', 'img_h')
+    out = {k: np.concatenate([s[k] for s in stats]) for k in keys}
+    out['count'] = sum(s['count'] for s in stats)
+    out['images'] = sum(s['images'] for s in stats)
+    return out
+
 def summarize_stats(s):
     if s['count'] == 0:
         return None
-    h = s['heights']
-    w = s['widths']
-    a = s['areas']
+    # Todos los percentiles de alto, ancho y área en una sola llamada
+    columns = np.stack([s['heights'], s['widths'], s['areas']])
+    p = np.percentile(columns, PERCENTILES, axis=1)
+    h = dict(zip(PERCENTILES, p[:, 0]))
+    w = dict(zip(PERCENTILES, p[:, 1]))
+    a = dict(zip(PERCENTILES, p[:, 2]))
     stats = {
         'count': s['count'],
-        'height_median': statistics.median(h),
-        'height_mean': statistics.mean(h),
-        'height_p25': percentile(h,25),
-        'height_p75': percentile(h,75),
-        'width_median': statistics.median(w),
-        'area_median': statistics.median(a)
+        'height_median': float(h[50]),
+        'height_mean': float(s['heights'].mean()),
+        'height_p5': float(h[5]),
+        'height_p25': float(h[25]),
+        'height_p75': float(h[75]),
+        'height_p95': float(h[95]),
+        'width_median': float(w[50]),
+        'width_p5': float(w[5]),
+        'width_p95': float(w[95]),
+        'area_median': float(a[50]),
     }
     return stats
 
-def percentile(data, p):
-    if not data:
-        return 0
-    
-    data_sorted = sorted(data)
-    k = (len(data_sorted)-1) * (p/100)
-    
-    f = math.floor(k)
-    c = math.ceil(k)
-    if f == c:
-        return data_sorted[int(k)]
-    d0 = data_sorted[int(f)] * (c-k)
-    d1 = data_sorted[int(c)] * (k-f)
-    return d0 + d1
-
-def recommend_imgsz(height_median):
-    if height_median < 16:
-        return ">=1024 (recomendado 1280)"
-    if height_median < 32:
-        return "640 - 1024 (recomendado 1024)"
-    if height_median < 64:
-        return "512 - 640 (recomendado 640)"
-    return "416 - 640 (recomendado 512 o 416 si GPU limitada)"
-
-def analyze_imgsz():
-    train_imgs = os.path.join("data", "train", "images")
-    train_lbls = os.path.join("data", "train", "labels")
-    val_imgs = os.path.join("data", "validation", "images")
-    val_lbls = os.path.join("data", "validation", "labels")
-
-    print("Analizando TRAIN...")
-    s_train = gather_bbox_stats(train_imgs, train_lbls)
-    
-    print("Analizando VALIDATION...")
-    s_val = gather_bbox_stats(val_imgs, val_lbls)
-
-    sum_train = summarize_stats(s_train) if s_train else None
-    sum_val = summarize_stats(s_val) if s_val else None
-
-    print("\n--- RESULTADOS TRAIN ---")
-    if sum_train:
-        for k,v in sum_train.items():
-            print(f"{k}: {v}")
-        print("Recomendación imgsz (train):", recommend_imgsz(sum_train['height_median']))
-    else:
-        print("No se encontraron bboxes en TRAIN.")
+def summarize_by_class(s):
+    """summarize_stats por cada clase."""
+    return {int(c): summarize_stats(_select(s, s['cls'] == c)) for c in np.unique(s['cls'])}
 
-    print("\n--- RESULTADOS VALIDATION ---")
-    if sum_val:
-        for k,v in sum_val.items():
-            print(f"{k}: {v}")
-        print("Recomendación imgsz (val):", recommend_imgsz(sum_val['height_median']))
-    else:
-        print("No se encontraron bboxes en VALIDATION.")
+def _select(s, mask):
+    out = {k: v[mask] for k, v in s.items() if isinstance(v, np.ndarray)}
+    out['count'] = int(np.count_nonzero(mask))
+    return out
+
+def size_histogram(s):
+    """Histograma 2D de cajas por (ancho, alto) en los intervalos de SIZE_BINS."""
+    hist, _, _ = np.histogram2d(s['widths'], s['heights'], bins=[SIZE_BINS, SIZE_BINS])
+    return hist.astype(np.int64)
+
+def print_histogram(hist):
+    names = [f"<{int(b)}" for b in SIZE_BINS[1:-1]] + [f">={int(SIZE_BINS[-2])}"]
+    print("alto \\ ancho " + "".join(f"{n:>8}" for n in names))
+    # Una fila por intervalo de alto
+    for i, name in enumerate(names):
+        print(f"{name:>12} " + "".join(f"{int(v):>8}" for v in hist[:, i]))
+
+def optimize_imgsz(s, candidates=CANDIDATE_IMGSZ, min_pixels=8, max_small_fraction=0.05, ref_imgsz=640):
+    """Simula cada imgsz candidato y los ordena por coste y cajas que quedan demasiado pequeñas.
+
+    Cada imagen se escala como en letterbox (lado mayor = imgsz), así que una
+    caja mide su tamaño original por imgsz / max(ancho, alto) de su imagen.
+    Para cada candidato (todos a la vez, con un array candidatos x cajas) se
+    calcula la fracción de cajas cuyo lado menor queda por debajo de
+    min_pixels y el alto mediano resultante. El coste relativo de inferencia
+    se estima como (imgsz / ref_imgsz)², proporcional a los píxeles.
+
+    Devuelve una fila por candidato: primero, de menor a mayor coste, los que
+    dejan como mucho max_small_fraction de cajas pequeñas; después el resto,
+    de menos a más cajas pequeñas.
+    """
+    if s['count'] == 0:
+        return []
+    sizes = np.array(candidates, dtype=np.float64)
+    base = 1.0 / np.maximum(s['img_w'], s['img_h'])
+    short_side = np.minimum(s['widths'], s['heights']) * base
+    small = (sizes[:, None] * short_side[None, :] < min_pixels).mean(axis=1)
+    median_height = sizes * float(np.median(s['heights'] * base))
+    cost = (sizes / ref_imgsz) ** 2
+
+    rows = [{'imgsz': int(size), 'small_fraction': float(f), 'median_height_px': float(mh),
+             'relative_cost': float(c), 'ok': bool(f <= max_small_fraction)}
+            for size, f, mh, c in zip(sizes, small, median_height, cost)]
+    return sorted(rows, key=lambda r: (not r['ok'], r['relative_cost'] if r['ok'] else r['small_fraction']))
+
+def _wh_iou(wh, centers):
+    """IoU entre cajas (N, 2) y centros (k, 2) alineados en la misma esquina, como matriz (N, k)."""
+    inter = np.minimum(wh[:, None, 0], centers[None, :, 0]) * np.minimum(wh[:, None, 1], centers[None, :, 1])
+    return inter / (wh[:, None, 0] * wh[:, None, 1] + centers[None, :, 0] * centers[None, :, 1] - inter)
+
+def kmeans_box_shapes(s, imgsz, k=9, iterations=50, max_boxes=100000, seed=0):
+    """k-means sobre (ancho, alto) de las cajas tras letterbox a imgsz, con 1 - IoU como distancia.
+
+    La asignación y la actualización de centros (media por cluster con
+    np.bincount) son vectoriales. Con más de max_boxes cajas se usa una
+    muestra aleatoria. Devuelve (centros ordenados por área, IoU medio con el
+    mejor centro, fracción de cajas con IoU > 0.5 con algún centro).
+    """
+    base = imgsz / np.maximum(s['img_w'], s['img_h'])
+    wh = np.stack([s['widths'] * base, s['heights'] * base], axis=1).astype(np.float64)
+    wh = wh[(wh >= 2).all(axis=1)]
+    if len(wh) == 0:
+        return np.empty((0, 2)), 0.0, 0.0
+    rng = np.random.default_rng(seed)
+    if len(wh) > max_boxes:
+        wh = wh[rng.choice(len(wh), max_boxes, replace=False)]
+    # Centros iniciales distintos: con pocas formas repetidas no puede haber más clusters que formas
+    shapes = np.unique(wh, axis=0)
+    k = min(k, len(shapes))
+
+    centers = shapes[rng.choice(len(shapes), k, replace=False)]
+    assign = None
+    for _ in range(iterations):
+        new_assign = _wh_iou(wh, centers).argmax(axis=1)
+        if assign is not None and np.array_equal(new_assign, assign):
+            break
+        assign = new_assign
+        counts = np.bincount(assign, minlength=k)
+        filled = counts > 0
+        centers[filled, 0] = np.bincount(assign, weights=wh[:, 0], minlength=k)[filled] / counts[filled]
+        centers[filled, 1] = np.bincount(assign, weights=wh[:, 1], minlength=k)[filled] / counts[filled]
+
+    best = _wh_iou(wh, centers).max(axis=1)
+    centers = centers[np.argsort(centers[:, 0] * centers[:, 1])]
+    return centers, float(best.mean()), float((best > 0.5).mean())
+
+def print_imgsz_table(rows, min_pixels=8, max_small_fraction=0.05):
+    print(f"\n--- IMGSZ: cajas con lado < {min_pixels}px tras letterbox (objetivo <= {max_small_fraction*100:.0f}%) ---")
+    print(f"{'rank':>4} {'imgsz':>6} {'pequeñas':>9} {'alto med.':>10} {'coste':>7}")
+    for rank, r in enumerate(rows, 1):
+        mark = '' if r['ok'] else '  (demasiadas pequeñas)'
+        print(f"{rank:>4} {r['imgsz']:>6} {r['small_fraction']*100:>8.1f}% {r['median_height_px']:>9.1f}px {r['relative_cost']:>6.2f}x{mark}")
+
+def print_box_shapes(centers, mean_iou, coverage, imgsz):
+    print(f"\n--- Formas de caja más frecuentes a imgsz {imgsz} (k-means, IoU medio {mean_iou:.2f}, "
+          f"{coverage*100:.1f}% de cajas con IoU > 0.5) ---")
+    for w, h in centers:
+        # Nivel de la pirámide donde caen cajas de ese tamaño (P3 stride 8, P4 stride 16, P5 stride 32)
+        level = 'P3' if max(w, h) < 64 else 'P4' if max(w, h) < 128 else 'P5'
+        print(f"  {w:6.1f} x {h:6.1f} px  ({level})")
+
+def print_summary(name, s):
+    summary = summarize_stats(s)
+    print(f"\n--- RESULTADOS {name} ---")
+    if summary is None:
+        print(f"No se encontraron bboxes en {name}.")
+        return None
+    print(f"imágenes: {s['images']}")
+    for k, v in summary.items():
+        print(f"{k}: {v:.1f}" if isinstance(v, float) else f"{k}: {v}")
+
+    print("\nPor clase:")
+    for cls, cls_summary in summarize_by_class(s).items():
+        print(f"  clase {cls}: {cls_summary['count']} cajas, alto mediano {cls_summary['height_median']:.1f}, "
+              f"p5-p95 {cls_summary['height_p5']:.1f}-{cls_summary['height_p95']:.1f}, ancho mediano {cls_summary['width_median']:.1f}")
+
+    print("\nHistograma de tamaños (píxeles de la imagen original):")
+    print_histogram(size_histogram(s))
+    return summary
+
+def analyze_imgsz(splits=("train", "validation"), sample_limit=None, workers=8, min_pixels=8, max_small_fraction=0.05):
+    """Estadísticas de tamaño de las cajas por split y en total (con sample_limit, sobre una muestra por split),
+    y la tabla de imgsz candidatos de optimize_imgsz con las formas de caja para el mejor."""
+    stats = {}
+    for split in splits:
+        print(f"Analizando {split.upper()}...")
+        stats[split] = gather_bbox_stats(os.path.join("data", split, "images"), os.path.join("data", split, "labels"),
+                                         sample_limit=sample_limit, workers=workers)
+
+    for split, s in stats.items():
+        print_summary(split.upper(), s)
+    total = concat_stats(list(stats.values()))
+    if len(stats) > 1:
+        print_summary("TOTAL", total)
+
+    rows = optimize_imgsz(total, min_pixels=min_pixels, max_small_fraction=max_small_fraction)
+    if rows:
+        print_imgsz_table(rows, min_pixels, max_small_fraction)
+        best = rows[0]['imgsz']
+        print(f"Recomendación imgsz: {best}")
+        print_box_shapes(*kmeans_box_shapes(total, best), best)
+    return stats
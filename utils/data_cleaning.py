@@ -1,106 +1,243 @@
 from pathlib import Path
 from PIL import Image
-import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import json
 import os
+import shutil
+import time
 
+from .dedup import HashCache, find_duplicates
+from .near_duplicates import plan_near_duplicates
 
-def clean_missing_labels(images_path, labels_path):
-    images = list[Path](Path(images_path).glob("*.*"))
-    removed = 0
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
 
-    for img in images:
-        label = Path(labels_path) / (img.stem + ".txt")
-        if not label.exists():
-            print(f"Eliminada imagen sin etiqueta: {img}")
-            img.unlink()
-            removed += 1
+# Problemas que puede tener un par imagen/etiqueta. Todos hacen que el par se elimine o se mueva a cuarentena.
+ISSUES = ("missing_label", "orphan_label", "corrupt_label", "corrupt_image", "duplicate", "near_duplicate")
 
-    print(f"✔ Proceso finalizado. Imágenes eliminadas: {removed}")
 
-
-def clean_corrupt_labels(labels_path, images_path):
-    removed = 0
-    for label_file in Path(labels_path).glob("*.txt"):
-        valid = True
-        with open(label_file, "r") as f:
-            for line in f:
-                parts = line.strip().split()
+def check_label(label_path):
+    """Devuelve None si la etiqueta YOLO es válida o el motivo por el que no lo es."""
+    n = 0
+    try:
+        with open(label_path, "r", encoding="utf-8") as f:
+            for n, line in enumerate(f, 1):
+                parts = line.split()
+                if not parts:
+                    continue
                 if len(parts) != 5:
-                    valid = False
-                    break
-                try:
-                    cls, x, y, w, h = map[float](parts)
-                    if not (0 <= x <= 1 and 0 <= y <= 1 and 0 <= w <= 1 and 0 <= h <= 1):
-                        valid = False
-                        break
-                except ValueError:
-                    valid = False
-                    break
-        
-        if not valid:
-            print(f"Etiqueta corrupta eliminada: {label_file}")
-            
-            img = Path(images_path) / (label_file.stem + ".jpg")
-            if img.exists():
-                img.unlink()
-            label_file.unlink()
-            removed += 1
-
-    print(f"✔ Labels corruptos eliminados: {removed}")
-
-
-def clean_corrupt_images(images_path, labels_path):
-    removed = 0
-    for img_path in Path(images_path).glob("*.*"):
-        try:
-            Image.open(img_path).verify()
-        except Exception:
-            print(f"Imagen dañada eliminada: {img_path}")
-            label = Path(labels_path) / (img_path.stem + ".txt")
-            if label.exists():
-                label.unlink()
-            img_path.unlink()
-            removed += 1
-
-    print(f"✔ Imágenes corruptas eliminadas: {removed}")
-
-
-def get_hash(file_path):
-    with open(file_path, "rb") as f:
-        return hashlib.md5(f.read()).hexdigest()
-
-def remove_duplicates(images_path):
-    seen = {}
-    removed = 0
-
-    for img in Path(images_path).glob("*.*"):
-        h = get_hash(img)
-        if h in seen:
-            print(f"Duplicado eliminado: {img}")
-            img.unlink()
-            removed += 1
+                    return f"línea {n}: {len(parts)} columnas"
+                cls, x, y, w, h = map(float, parts)
+                if not (0 <= x <= 1 and 0 <= y <= 1 and 0 <= w <= 1 and 0 <= h <= 1):
+                    return f"línea {n}: coordenadas fuera de [0, 1]"
+    except UnicodeDecodeError:
+        return f"línea {n + 1}: no se pudo decodificar"
+    except ValueError:
+        return f"línea {n}: valor no numérico"
+    except OSError as e:
+        return f"no se pudo leer: {e}"
+    return None
+
+
+def check_image(img_path):
+    """Devuelve None si PIL puede verificar la imagen o el motivo por el que no."""
+    try:
+        with Image.open(img_path) as img:
+            img.verify()
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def validate_pair(pair):
+    """Ejecuta todas las comprobaciones de un par (imagen o None, etiqueta o None)."""
+    img_path, label_path = pair
+    result = {"image": str(img_path) if img_path else None, "label": str(label_path) if label_path else None,
+              "issues": {}}
+    if img_path is None:
+        result["issues"]["orphan_label"] = "etiqueta sin imagen"
+        return result
+    if label_path is None:
+        result["issues"]["missing_label"] = "imagen sin etiqueta"
+    else:
+        error = check_label(label_path)
+        if error is not None:
+            result["issues"]["corrupt_label"] = error
+    error = check_image(img_path)
+    if error is not None:
+        result["issues"]["corrupt_image"] = error
+    return result
+
+
+def list_pairs(images_path, labels_path):
+    """Empareja imágenes y etiquetas por nombre, listando cada carpeta una sola vez.
+
+    Devuelve (pares, otros). Los archivos de images_path con una extensión
+    que no está en IMG_EXTS no se validan ni se tocan: van a otros como
+    (archivo, etiqueta o None), y su etiqueta no cuenta como huérfana.
+    """
+    files = sorted(e.path for e in os.scandir(images_path) if e.is_file()) if os.path.isdir(images_path) else []
+    labels = {Path(e.name).stem: Path(e.path) for e in os.scandir(labels_path) if e.is_file() and e.name.endswith(".txt")} \
+        if os.path.isdir(labels_path) else {}
+
+    pairs = []
+    others = []
+    paired = set()
+    for path in map(Path, files):
+        label = labels.get(path.stem)
+        if path.suffix.lower() in IMG_EXTS:
+            pairs.append((path, label))
         else:
-            seen[h] = img
-    
-    print(f"✔ Imágenes duplicadas eliminadas: {removed}")
-
-
-
-
-def data_cleaning():
-    train_images_path = os.path.join("data", "train", "images")
-    train_labels_path = os.path.join("data", "train", "labels")
-    validation_images_path = os.path.join("data", "validation", "images")
-    validation_labels_path = os.path.join("data", "validation", "labels")
-
-    clean_missing_labels(train_images_path, train_labels_path)
-    clean_missing_labels(validation_images_path, validation_labels_path)
-
-    clean_corrupt_labels(train_labels_path, train_images_path)
-    clean_corrupt_labels(validation_labels_path, validation_images_path)
-
-    clean_corrupt_images(train_images_path, train_labels_path)
-    clean_corrupt_images(validation_images_path, validation_labels_path)
-
-    remove_duplicates(train_images_path)
-    remove_duplicates(validation_images_path)
+            others.append((str(path), str(label) if label else None))
+        paired.add(path.stem)
+    pairs.extend((None, label) for stem, label in sorted(labels.items()) if stem not in paired)
+    return pairs, others
+
+
+def validate_dataset(data_root="data", splits=("train", "validation"), workers=None, chunksize=16, hash_cache=None,
+                     near_radius=None, near_keep="first", near_cross_split="report"):
+    """Valida todos los pares imagen/etiqueta de data_root en un pool de procesos, en una sola pasada.
+
+    Cada imagen se abre una vez para verificarla y cada etiqueta se lee una
+    vez. Después se buscan imágenes idénticas entre las válidas de todos los
+    splits con find_duplicates (hash_cache es la ruta de la caché de
+    hashes): dentro de un split se marcan como "duplicate" (se conserva la
+    primera en orden alfabético), y las que aparecen en varios splits se
+    listan en "leakage" sin tocarlas.
+
+    Con near_radius se buscan además imágenes casi idénticas (por ejemplo
+    fotogramas seguidos de un vídeo) con plan_near_duplicates, a esa
+    distancia de Hamming entre dHash de 64 bits; near_keep y
+    near_cross_split son sus políticas. Las que cruzan splits van a
+    "near_leakage".
+
+    No se modifica ningún archivo: devuelve un informe
+    {"entries": [...], "leakage": [...], "skipped": [...], "counts": {problema: n}, "pairs": n}
+    con una entrada por par con problemas; apply_report() lo aplica. En
+    "skipped" van los archivos de images con extensión desconocida (y su
+    etiqueta), que solo se informan.
+    """
+    workers = workers or os.cpu_count() or 1
+    entries = []
+    valid = {}  # imagen válida -> (split, etiqueta)
+    skipped = []
+    total = 0
+    t_begin = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for split in splits:
+            pairs, others = list_pairs(os.path.join(data_root, split, "images"), os.path.join(data_root, split, "labels"))
+            skipped.extend({"image": image, "label": label, "split": split} for image, label in others)
+            total += len(pairs)
+            for result in pool.map(validate_pair, pairs, chunksize=chunksize):
+                if result["issues"]:
+                    result["split"] = split
+                    entries.append(result)
+                else:
+                    valid[result["image"]] = (split, result["label"])
+
+    cache = HashCache(hash_cache)
+    leakage = []
+    for group in find_duplicates(list(valid), cache, workers=workers):
+        kept = {}
+        for path in group:
+            split, label = valid[path]
+            if split in kept:
+                entries.append({"image": path, "label": label, "split": split,
+                                "issues": {"duplicate": f"igual que {kept[split]}"}})
+            else:
+                kept[split] = path
+        if len(kept) > 1:
+            leakage.append(kept)
+    cache.save()
+
+    near_leakage = []
+    if near_radius is not None:
+        removed = {e["image"] for e in entries}
+        remaining = [(path, split, label) for path, (split, label) in valid.items() if path not in removed]
+        near_entries, near_leakage = plan_near_duplicates(remaining, radius=near_radius, keep=near_keep,
+                                                          cross_split=near_cross_split, workers=workers)
+        entries.extend(near_entries)
+
+    counts = {issue: sum(1 for e in entries if issue in e["issues"]) for issue in ISSUES}
+    counts["leakage"] = len(leakage)
+    counts["near_leakage"] = len(near_leakage)
+    counts["skipped"] = len(skipped)
+    elapsed = time.perf_counter() - t_begin
+    print(f"🔍 {total} pares validados en {elapsed:.1f} s ({total / max(elapsed, 1e-9):.0f} pares/s, {workers} procesos; "
+          f"hashes: {cache.hits} de caché, {cache.misses} calculados)")
+    return {"entries": entries, "leakage": leakage, "near_leakage": near_leakage, "skipped": skipped,
+            "counts": counts, "pairs": total}
+
+
+def apply_report(report, quarantine_dir=None, data_root="data"):
+    """Elimina (o mueve a quarantine_dir, conservando split/images y split/labels) los archivos del informe, todos de una vez."""
+    files = []
+    for entry in report["entries"]:
+        files.extend(p for p in (entry["image"], entry["label"]) if p is not None)
+
+    moved = 0
+    for path in files:
+        if not os.path.exists(path):
+            continue
+        if quarantine_dir is None:
+            os.remove(path)
+        else:
+            target = Path(quarantine_dir) / Path(path).relative_to(data_root)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(path, target)
+        moved += 1
+    return moved
+
+
+def print_report(report):
+    labels = {"missing_label": "imágenes sin etiqueta", "orphan_label": "etiquetas sin imagen",
+              "corrupt_label": "etiquetas corruptas", "corrupt_image": "imágenes dañadas", "duplicate": "imágenes duplicadas",
+              "near_duplicate": "imágenes casi duplicadas"}
+    for entry in report["entries"]:
+        reasons = "; ".join(f"{issue}: {detail}" for issue, detail in entry["issues"].items())
+        print(f"   [{entry['split']}] {entry['image'] or entry['label']}: {reasons}")
+    for issue in ISSUES:
+        print(f"✔ {labels[issue]}: {report['counts'][issue]}")
+
+    # Fuga entre splits: la misma imagen en train y validation infla las métricas de validación
+    for kept in report["leakage"]:
+        print("⚠ Imagen repetida entre splits: " + ", ".join(f"{split}: {path}" for split, path in kept.items()))
+    if report["leakage"]:
+        print(f"⚠ {len(report['leakage'])} imágenes aparecen en más de un split (no se eliminan automáticamente)")
+    for kept in report.get("near_leakage", []):
+        print("⚠ Imágenes casi iguales entre splits: " + ", ".join(f"{split}: {path}" for split, path in kept.items()))
+    if report.get("near_leakage"):
+        print(f"⚠ {len(report['near_leakage'])} grupos de imágenes casi iguales aparecen en más de un split")
+
+    for entry in report.get("skipped", []):
+        print(f"⚠ [{entry['split']}] {entry['image']}: extensión desconocida, no se valida (etiqueta: {entry['label']})")
+    if report.get("skipped"):
+        print(f"⚠ {len(report['skipped'])} archivos con extensión desconocida (no se eliminan automáticamente)")
+
+
+def data_cleaning(dry_run=False, quarantine_dir=None, report_path=None, workers=None, hash_cache=".dedup_cache.json",
+                  near_radius=None, near_keep="first", near_cross_split="report"):
+    """Valida data/train y data/validation y elimina los pares con problemas.
+
+    Con dry_run=True solo se muestra (y se guarda en report_path, si se da)
+    el informe. Con quarantine_dir los archivos se mueven allí en lugar de
+    borrarse. near_radius (por ejemplo 4) activa la búsqueda de casi
+    duplicados; ver validate_dataset.
+    """
+    report = validate_dataset("data", ("train", "validation"), workers=workers, hash_cache=hash_cache,
+                              near_radius=near_radius, near_keep=near_keep, near_cross_split=near_cross_split)
+    print_report(report)
+
+    if report_path is not None:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=1, ensure_ascii=False)
+        print(f"📝 Informe guardado en {report_path}")
+
+    if dry_run:
+        print("Modo dry run: no se ha modificado ningún archivo.")
+        return report
+
+    changed = apply_report(report, quarantine_dir=quarantine_dir, data_root="data")
+    action = f"movidos a {quarantine_dir}" if quarantine_dir else "eliminados"
+    print(f"✔ Proceso finalizado. Archivos {action}: {changed}")
+    return report
@@ -1,46 +1,44 @@
 import cv2
 import numpy as np
 from pathlib import Path
-import shutil
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-def apply_white_balance(img):
-    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-    L, A, B = cv2.split(lab)
+from .dataset_shards import export_shards
+from .image_enhance import EnhancementPipeline
 
-    A = A.astype(np.float32)
-    B = B.astype(np.float32)
+# Versión del algoritmo de preprocesado. Si cambia, o cambian los parámetros de TRAINING_ENHANCEMENT,
+# el manifiesto deja de valer y se vuelven a generar todas las imágenes.
+PREPROCESS_VERSION = 3
 
-    A = A - np.mean(A) + 128
-    B = B - np.mean(B) + 128
+MANIFEST_NAME = ".preprocess_manifest.json"
 
-    A = np.clip(A, 0, 255).astype(np.uint8)
-    B = np.clip(B, 0, 255).astype(np.uint8)
+# Un pipeline por proceso: reutiliza sus buffers entre imágenes del mismo tamaño
+_enhancer = None
 
-    lab_balanced = cv2.merge([L, A, B])
-    return cv2.cvtColor(lab_balanced, cv2.COLOR_LAB2BGR)
+def get_enhancer():
+    global _enhancer
+    if _enhancer is None:
+        _enhancer = EnhancementPipeline.training()
+    return _enhancer
 
+def letterbox_size(h, w, new_size=512):
+    """Tamaño (ancho, alto) de la imagen escalada dentro del lienzo cuadrado de letterbox."""
+    scale = new_size / max(h, w)
+    return int(w * scale), int(h * scale)
 
-def apply_clahe(img):
-    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-    L, A, B = cv2.split(lab)
-
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-    L_clahe = clahe.apply(L)
-
-    lab_clahe = cv2.merge([L_clahe, A, B])
-    return cv2.cvtColor(lab_clahe, cv2.COLOR_LAB2BGR)
-
-def apply_gamma(img, gamma=1.0):
-    inv_gamma = 1.0 / gamma
-    table = np.array([(i / 255.0) ** inv_gamma * 255 for i in np.arange(0, 256)]).astype("uint8")
-    return cv2.LUT(img, table)
+def letterbox_transform(h, w, new_size=512):
+    """Transformación afín (sx, sy, ox, oy) que letterbox aplica a coordenadas normalizadas: x' = x * sx + ox."""
+    new_w, new_h = letterbox_size(h, w, new_size)
+    # La imagen queda arriba a la izquierda del lienzo, así que no hay desplazamiento
+    return new_w / new_size, new_h / new_size, 0.0, 0.0
 
 def letterbox(img, new_size=512):
     h, w = img.shape[:2]
-    scale = new_size / max(h, w)
-
-    new_w = int(w * scale)
-    new_h = int(h * scale)
+    new_w, new_h = letterbox_size(h, w, new_size)
 
     resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
 
@@ -50,51 +48,302 @@ def letterbox(img, new_size=512):
     return canvas
 
 def preprocess_image(img_path, output_path, size=512):
+    """Preprocesa una imagen y la guarda.
+
+    Devuelve (transformación de letterbox_transform, None) si todo fue bien o
+    (None, mensaje de error).
+    """
     img = cv2.imread(str(img_path))
     if img is None:
-        print(f"⚠ Imagen no cargada: {img_path}")
-        return
+        return None, "imagen no cargada"
 
-    img = apply_white_balance(img)
-    img = apply_clahe(img)
-    img = apply_gamma(img, gamma=1.0)
+    transform = letterbox_transform(img.shape[0], img.shape[1], size)
+    img = get_enhancer()(img)  # Balance de blancos + CLAHE en una sola conversión LAB, y gamma
     img = letterbox(img, new_size=size)
 
-    cv2.imwrite(str(output_path), img)
+    if not cv2.imwrite(str(output_path), img):
+        return None, "no se pudo escribir la imagen"
+    return transform, None
+
+def transform_labels(jobs, size=512):
+    """Reescribe etiquetas YOLO para que coincidan con sus imágenes tras letterbox.
+
+    jobs es una lista de (etiqueta origen, etiqueta destino, (sx, sy, ox, oy)).
+    Todas las cajas de todos los archivos se transforman juntas en un único
+    lote de NumPy: escala y desplazamiento, recorte al lienzo y descarte de
+    cajas de menos de un píxel. Los archivos con alguna línea que no tenga
+    exactamente 5 columnas se rechazan. Devuelve (archivos escritos, cajas
+    descartadas, [(ruta, error), ...]).
+    """
+    arrays, counts, ok_jobs, errors = [], [], [], []
+    for src, dst, transform in jobs:
+        try:
+            data = Path(src).read_bytes()
+            values = np.array(data.split(), dtype=np.float64)
+        except (OSError, ValueError) as e:
+            errors.append((str(src), f"etiqueta ilegible: {e}"))
+            continue
+        # Se comprueba cada línea: con líneas de 6 y 4 columnas el total también puede ser múltiplo de 5
+        if any(len(line.split()) != 5 for line in data.splitlines() if line.strip()):
+            errors.append((str(src), "la etiqueta no tiene 5 columnas (clase x y w h) por línea"))
+            continue
+        arrays.append(values.reshape(-1, 5))
+        counts.append(values.size // 5)
+        ok_jobs.append((dst, transform))
+
+    if not ok_jobs:
+        return 0, 0, errors
+
+    boxes = np.concatenate(arrays)
+    sx, sy, ox, oy = np.repeat(np.array([t for _, t in ok_jobs], dtype=np.float64), counts, axis=0).T
+
+    x1 = np.clip((boxes[:, 1] - boxes[:, 3] / 2) * sx + ox, 0, 1)
+    x2 = np.clip((boxes[:, 1] + boxes[:, 3] / 2) * sx + ox, 0, 1)
+    y1 = np.clip((boxes[:, 2] - boxes[:, 4] / 2) * sy + oy, 0, 1)
+    y2 = np.clip((boxes[:, 2] + boxes[:, 4] / 2) * sy + oy, 0, 1)
+    out = np.stack([boxes[:, 0], (x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], axis=1)
+    keep = (out[:, 3] * size >= 1) & (out[:, 4] * size >= 1)
+
+    splits = np.cumsum(counts)[:-1]
+    for (dst, _), rows, kept in zip(ok_jobs, np.split(out, splits), np.split(keep, splits)):
+        rows = rows[kept]
+        # Un solo formateo por archivo en vez de una cadena por línea
+        text = ("%d %.6f %.6f %.6f %.6f\n" * len(rows)) % tuple(rows.ravel())
+        try:
+            with open(dst, "w") as f:
+                f.write(text)
+        except OSError as e:
+            errors.append((str(dst), f"no se pudo escribir la etiqueta: {e}"))
+    return len(ok_jobs), int(np.count_nonzero(~keep)), errors
+
+def preprocess_params(size):
+    """Parámetros que determinan el resultado de preprocess_image."""
+    return {"version": PREPROCESS_VERSION, "size": size, **get_enhancer().params()}
+
+def file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_manifest(dst_root):
+    path = Path(dst_root) / MANIFEST_NAME
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"params": None, "files": {}}
+
+def save_manifest(dst_root, manifest):
+    # Se escribe a un temporal y se renombra para no dejar nunca un manifiesto a medias
+    path = Path(dst_root) / MANIFEST_NAME
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+class SourceHasher:
+    """Hash de los archivos fuente, reutilizando el del manifiesto si tamaño y mtime no cambiaron."""
+
+    def __init__(self, previous_files):
+        self.previous = {entry["src"]: entry for entry in previous_files.values()}
+        self.hashed = 0
 
-def copy_label(label_path, output_path):
-    shutil.copy(label_path, output_path)
+    def __call__(self, src_path):
+        st = os.stat(src_path)
+        entry = self.previous.get(str(src_path))
+        if entry is not None and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            return entry["hash"], st
+        self.hashed += 1
+        return file_hash(src_path), st
 
-def process_dataset(src_root, dst_root, size=512):
+def _process_item(item):
+    """Procesa una imagen. Devuelve (ruta, transformación o None, error o None)."""
+    img_path, out_img, size = item
+    try:
+        transform, error = preprocess_image(img_path, out_img, size=size)
+    except Exception as e:
+        transform, error = None, f"{type(e).__name__}: {e}"
+    return str(img_path), transform, error
+
+def _init_worker():
+    # Cada proceso usa un solo hilo de OpenCV para no competir por los núcleos
+    cv2.setNumThreads(1)
+
+def _split_items(src_root, dst_root, split, size):
+    """Pares (fuente, salida) de imágenes y etiquetas de un split."""
+    src_img_dir = Path(src_root) / split / "images"
+    src_lbl_dir = Path(src_root) / split / "labels"
+
+    dst_img_dir = Path(dst_root) / split / "images"
+    dst_lbl_dir = Path(dst_root) / split / "labels"
+
+    dst_img_dir.mkdir(parents=True, exist_ok=True)
+    dst_lbl_dir.mkdir(parents=True, exist_ok=True)
+
+    items = []
+    for img_path in sorted(src_img_dir.glob("*.*")):
+        label_path = src_lbl_dir / (img_path.stem + ".txt")
+        if not label_path.exists():
+            label_path = None
+        items.append((img_path, dst_img_dir / img_path.name, label_path,
+                      dst_lbl_dir / label_path.name if label_path is not None else None))
+    return items
+
+def process_dataset(src_root, dst_root, size=512, workers=1, chunksize=8, progress_every=200, incremental=True):
+    """Preprocesa train/validation/test de src_root en dst_root.
+
+    Con workers > 1 las imágenes se reparten en bloques de chunksize entre un
+    pool de procesos. Cada imagen pasa por las mismas funciones que en modo
+    serie, así que los archivos generados son idénticos byte a byte. Los
+    errores se acumulan y se muestran en un resumen al final; también se
+    devuelven como {split: [(ruta, error), ...]}.
+
+    Las etiquetas se reescriben con la transformación de letterbox de su
+    imagen (ver transform_labels), todas las de un split en un solo lote.
+    Si la etiqueta de una imagen se rechaza, la imagen tampoco se genera.
+
+    Con incremental=True se guarda en dst_root un manifiesto con el hash de
+    cada archivo fuente, la transformación de cada imagen y los parámetros
+    del preprocesado. En la siguiente ejecución solo se regeneran las
+    imágenes y etiquetas cuya fuente cambió, y se borran las salidas cuya
+    fuente ya no existe.
+    """
     splits = ["train", "validation", "test"]
+    errors = {}
+    params = preprocess_params(size)
+
+    previous = load_manifest(dst_root) if incremental else {"params": None, "files": {}}
+    # Con parámetros distintos ninguna salida anterior sirve, pero se recuerdan para poder borrar las huérfanas
+    reusable = previous["files"] if previous["params"] == params else {}
+    hasher = SourceHasher(previous["files"])
+    files = {}
+
+    def source_entry(src):
+        digest, st = hasher(src)
+        return {"src": str(src), "hash": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def is_current(key, entry, out):
+        old = reusable.get(key)
+        return old is not None and old["hash"] == entry["hash"] and out.exists()
+
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) if workers > 1 else None
+    t_begin = time.perf_counter()
+    total_done = 0
+    total_skipped = 0
+    total_labels = 0
+    total_dropped = 0
+
+    try:
+        for split in splits:
+            print(f"🔧 Procesando {split}…")
+            items = []
+            image_entries = []
+            label_jobs = []
+            skipped = 0
+            for img_path, out_img, label_path, out_label in _split_items(src_root, dst_root, split, size):
+                img_key = out_img.relative_to(dst_root).as_posix()
+                img_entry = source_entry(img_path)
+                image_current = is_current(img_key, img_entry, out_img) and "transform" in reusable[img_key]
+                if image_current:
+                    img_entry["transform"] = reusable[img_key]["transform"]
+                    files[img_key] = img_entry
+                else:
+                    items.append((img_path, out_img, size))
+                    image_entries.append((img_key, img_entry))
+
+                label_current = True
+                if label_path is not None:
+                    lbl_key = out_label.relative_to(dst_root).as_posix()
+                    lbl_entry = source_entry(label_path)
+                    # Una etiqueta se rehace si cambió ella o su imagen (la transformación depende del tamaño)
+                    label_current = image_current and is_current(lbl_key, lbl_entry, out_label)
+                    if label_current:
+                        files[lbl_key] = lbl_entry
+                    else:
+                        label_jobs.append((label_path, out_label, img_key, lbl_key, lbl_entry))
+
+                if image_current and label_current:
+                    skipped += 1
+
+            if pool is not None:
+                results = pool.map(_process_item, items, chunksize=chunksize)
+            else:
+                results = map(_process_item, items)
+
+            t_split = time.perf_counter()
+            errors[split] = []
+            for done, ((img_key, img_entry), (img_path, transform, error)) in enumerate(zip(image_entries, results), 1):
+                # Las imágenes con error no entran en el manifiesto, así se reintentan la próxima vez
+                if error is not None:
+                    errors[split].append((img_path, error))
+                else:
+                    img_entry["transform"] = list(transform)
+                    files[img_key] = img_entry
+                if done % progress_every == 0 or done == len(items):
+                    rate = done / max(time.perf_counter() - t_split, 1e-9)
+                    print(f"   {done}/{len(items)} imágenes ({rate:.1f} img/s)")
 
-    for split in splits:
-        print(f"🔧 Procesando {split}…")
+            # Etiquetas de todo el split en un solo lote, con la transformación de su imagen
+            label_jobs = [job for job in label_jobs if job[2] in files]
+            written, dropped, label_errors = transform_labels(
+                [(label_path, out_label, files[img_key]["transform"]) for label_path, out_label, img_key, _, _ in label_jobs], size)
+            failed_labels = {path for path, _ in label_errors}
+            for label_path, out_label, img_key, lbl_key, lbl_entry in label_jobs:
+                if str(label_path) not in failed_labels and str(out_label) not in failed_labels:
+                    files[lbl_key] = lbl_entry
+                    continue
+                # Sin su etiqueta la imagen se entrenaría como fondo puro: se descarta también
+                files.pop(img_key, None)
+                for out in (Path(dst_root) / img_key, out_label):
+                    if out.exists():
+                        out.unlink()
+            errors[split].extend(label_errors)
 
-        src_img_dir = Path(src_root) / split / "images"
-        src_lbl_dir = Path(src_root) / split / "labels"
+            total_done += len(items)
+            total_skipped += skipped
+            total_labels += written
+            total_dropped += dropped
 
-        dst_img_dir = Path(dst_root) / split / "images"
-        dst_lbl_dir = Path(dst_root) / split / "labels"
+            print(f"✔ {split} completado ({len(items)} imágenes y {written} etiquetas procesadas, "
+                  f"{len(errors[split])} con error, {skipped} sin cambios, {dropped} cajas descartadas).\n")
+    finally:
+        if pool is not None:
+            pool.shutdown()
 
-        dst_img_dir.mkdir(parents=True, exist_ok=True)
-        dst_lbl_dir.mkdir(parents=True, exist_ok=True)
+    # Borrar las salidas que ya no corresponden a ninguna fuente (o cuya fuente ahora falla)
+    removed = 0
+    for key in previous["files"].keys() - files.keys():
+        out = Path(dst_root) / key
+        if out.exists():
+            out.unlink()
+            removed += 1
 
-        for img_path in src_img_dir.glob("*.*"):
-            out_img = dst_img_dir / img_path.name
-            preprocess_image(img_path, out_img, size=size)
+    if incremental:
+        save_manifest(dst_root, {"params": params, "files": files})
 
-            label_path = src_lbl_dir / (img_path.stem + ".txt")
-            if label_path.exists():
-                copy_label(label_path, dst_lbl_dir / label_path.name)
+    elapsed = time.perf_counter() - t_begin
+    print(f"⏱ {total_done} imágenes y {total_labels} etiquetas procesadas, {total_skipped} sin cambios, "
+          f"{total_dropped} cajas degeneradas descartadas, {removed} salidas borradas, "
+          f"{hasher.hashed} archivos leídos para hash, en {elapsed:.1f} s ({workers} proceso(s))")
 
-        print(f"✔ {split} completado.\n")
+    failed = [(split, path, error) for split, split_errors in errors.items() for path, error in split_errors]
+    if failed:
+        print(f"⚠ {len(failed)} archivos con error:")
+        for split, path, error in failed:
+            print(f"   [{split}] {path}: {error}")
 
     print("🎉 Dataset preprocesado creado en:", dst_root)
+    return errors
 
-def data_preprocess(datap_path):
+def data_preprocess(datap_path, workers=None, shards_path=None):
     process_dataset(
         src_root="data",
         dst_root=datap_path,
-        size=512
+        size=512,
+        workers=workers or os.cpu_count() or 1
     )
+    # Opcional: empaquetar el resultado en shards para np.memmap (ver dataset_shards.ShardedDataset)
+    if shards_path is not None:
+        export_shards(datap_path, shards_path, size=512)
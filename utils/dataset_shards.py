@@ -0,0 +1,170 @@
+import cv2
+import numpy as np
+from pathlib import Path
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SHARDS_MANIFEST = "shards.json"
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp"}
+
+
+def _read_labels(label_path):
+    """Cajas YOLO (clase, x, y, w, h) de un archivo como array float32 (k, 5)."""
+    if label_path is None or not label_path.exists():
+        return np.empty((0, 5), dtype=np.float32)
+    data = label_path.read_bytes()
+    values = np.array(data.split(), dtype=np.float32)
+    # Se comprueba cada línea: con líneas de 6 y 4 columnas el total también puede ser múltiplo de 5
+    if any(len(line.split()) != 5 for line in data.splitlines() if line.strip()):
+        raise ValueError("la etiqueta no tiene 5 columnas (clase x y w h) por línea")
+    return values.reshape(-1, 5)
+
+
+def _read_pair(item):
+    img_path, label_path = item
+    img = cv2.imread(str(img_path))
+    if img is None:
+        return None, None, "imagen no cargada"
+    try:
+        labels = _read_labels(label_path)
+    except (OSError, ValueError) as e:
+        return None, None, f"etiqueta ilegible: {e}"
+    return img, labels, None
+
+
+def export_shards(data_root, shard_root, size=512, shard_size=1024, workers=8):
+    """Empaqueta cada split de data_root (salida de process_dataset) en shards para np.memmap.
+
+    Cada shard son tres archivos .npy: las imágenes como un único array
+    uint8 (n, size, size, 3) en BGR, todas las cajas del shard como float32
+    (m, 5) y un índice int64 (n + 1,) con el desplazamiento de las cajas de
+    cada imagen. shards.json guarda la lista de shards y el nombre de cada
+    imagen. Las imágenes se decodifican en paralelo en un pool de hilos.
+    Devuelve {split: [(ruta, error), ...]}.
+    """
+    splits = ["train", "validation", "test"]
+    shard_root = Path(shard_root)
+    shard_root.mkdir(parents=True, exist_ok=True)
+    manifest = {"size": size, "splits": {}}
+    errors = {}
+    t_begin = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for split in splits:
+            img_dir = Path(data_root) / split / "images"
+            lbl_dir = Path(data_root) / split / "labels"
+            if not img_dir.is_dir():
+                continue
+            print(f"📦 Empaquetando {split}…")
+
+            items = [(p, lbl_dir / (p.stem + ".txt")) for p in sorted(img_dir.iterdir()) if p.suffix.lower() in IMG_EXTS]
+            errors[split] = []
+            shards = []
+            names = []
+
+            for start in range(0, len(items), shard_size):
+                chunk = items[start:start + shard_size]
+                prefix = f"{split}_{len(shards):05d}"
+                images = np.lib.format.open_memmap(shard_root / f"{prefix}.images.npy", mode="w+",
+                                                   dtype=np.uint8, shape=(len(chunk), size, size, 3))
+                labels = []
+                n = 0
+                for (img_path, _), (img, boxes, error) in zip(chunk, pool.map(_read_pair, chunk)):
+                    if error is None and img.shape != (size, size, 3):
+                        error = f"tamaño {img.shape[1]}x{img.shape[0]}, se esperaba {size}x{size} (¿se preprocesó con otro size?)"
+                    if error is not None:
+                        errors[split].append((str(img_path), error))
+                        continue
+                    images[n] = img
+                    labels.append(boxes)
+                    names.append(img_path.name)
+                    n += 1
+                images.flush()
+                del images
+
+                # Si alguna imagen falló el array se quedó con huecos al final: se recorta
+                if n < len(chunk):
+                    _truncate_npy(shard_root / f"{prefix}.images.npy", n)
+
+                offsets = np.zeros(n + 1, dtype=np.int64)
+                offsets[1:] = np.cumsum([len(b) for b in labels])
+                np.save(shard_root / f"{prefix}.labels.npy",
+                        np.concatenate(labels) if labels else np.empty((0, 5), dtype=np.float32))
+                np.save(shard_root / f"{prefix}.index.npy", offsets)
+                shards.append({"prefix": prefix, "count": n})
+
+            manifest["splits"][split] = {"shards": shards, "names": names}
+            print(f"✔ {split}: {len(names)} imágenes en {len(shards)} shards, {len(errors[split])} con error.")
+
+    tmp_path = shard_root / (SHARDS_MANIFEST + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, shard_root / SHARDS_MANIFEST)
+    print(f"🎉 Shards creados en {shard_root} en {time.perf_counter() - t_begin:.1f} s")
+    return errors
+
+
+def _load(path):
+    """np.load con mmap; los arrays vacíos no se pueden mapear y se cargan normalmente."""
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        return np.load(path)
+
+
+def _truncate_npy(path, n):
+    """Deja solo las n primeras imágenes de un .npy escrito con open_memmap."""
+    full = _load(path)
+    kept = np.array(full[:n])
+    del full
+    np.save(path, kept)
+
+
+class ShardedDataset:
+    """Acceso aleatorio sin copias a los pares (imagen, cajas) de un split empaquetado.
+
+    Los shards se abren con np.load(mmap_mode="r") la primera vez que se
+    necesitan, así que abrir el dataset solo lee shards.json. dataset[i]
+    devuelve vistas de solo lectura sobre los archivos: la imagen uint8
+    (size, size, 3) en BGR y sus cajas float32 (k, 5).
+    """
+
+    def __init__(self, shard_root, split):
+        self.shard_root = Path(shard_root)
+        with open(self.shard_root / SHARDS_MANIFEST) as f:
+            manifest = json.load(f)
+        if split not in manifest["splits"]:
+            raise KeyError(f"El split {split} no está en {self.shard_root / SHARDS_MANIFEST}")
+        info = manifest["splits"][split]
+        self.size = manifest["size"]
+        self.names = info["names"]
+        self._prefixes = [s["prefix"] for s in info["shards"]]
+        self._starts = np.cumsum([0] + [s["count"] for s in info["shards"]])
+        self._open = {}
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def _shard(self, s):
+        shard = self._open.get(s)
+        if shard is None:
+            prefix = self.shard_root / self._prefixes[s]
+            shard = (_load(f"{prefix}.images.npy"), _load(f"{prefix}.labels.npy"), np.load(f"{prefix}.index.npy"))
+            self._open[s] = shard
+        return shard
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"Índice {i} fuera de rango para {len(self)} imágenes")
+        s = int(np.searchsorted(self._starts, i, side="right")) - 1
+        images, labels, offsets = self._shard(s)
+        j = i - self._starts[s]
+        return images[j], labels[offsets[j]:offsets[j + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
@@ -0,0 +1,91 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """BLAKE2b del archivo leído en bloques de tamaño fijo (nunca entero en memoria)."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class HashCache:
+    """Hashes guardados en disco por ruta, válidos mientras el tamaño y el mtime no cambien."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+        self._used = set()
+
+    def get(self, path, st):
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            self.hits += 1
+            self._used.add(path)
+            return entry[2]
+        return None
+
+    def put(self, path, st, digest):
+        self.misses += 1
+        self.entries[path] = [st.st_size, st.st_mtime_ns, digest]
+        self._used.add(path)
+
+    def save(self):
+        """Guarda solo las entradas usadas en esta ejecución, así las rutas borradas no se acumulan."""
+        if self.path is None:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({p: e for p, e in self.entries.items() if p in self._used}, f)
+        os.replace(tmp_path, self.path)
+
+
+def find_duplicates(paths, cache=None, workers=8):
+    """Agrupa los archivos con contenido idéntico.
+
+    Primero se agrupan por tamaño (un stat por archivo) y solo se calcula el
+    hash de los que comparten tamaño con otro; los hashes ya presentes en
+    cache no se vuelven a calcular. Devuelve una lista de grupos (listas
+    ordenadas de rutas con dos o más elementos).
+    """
+    cache = cache or HashCache()
+    by_size = defaultdict(list)
+    stats = {}
+    for path in paths:
+        st = os.stat(path)
+        stats[path] = st
+        by_size[st.st_size].append(path)
+
+    candidates = [p for group in by_size.values() if len(group) > 1 for p in group]
+    digests = {}
+    to_hash = []
+    for path in candidates:
+        digest = cache.get(path, stats[path])
+        if digest is None:
+            to_hash.append(path)
+        else:
+            digests[path] = digest
+
+    # hashlib suelta el GIL en bloques grandes, así que los hilos leen y calculan en paralelo
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, digest in zip(to_hash, pool.map(file_digest, to_hash)):
+            cache.put(path, stats[path], digest)
+            digests[path] = digest
+
+    groups = defaultdict(list)
+    for path in candidates:
+        groups[(stats[path].st_size, digests[path])].append(path)
+    return [sorted(group) for group in groups.values() if len(group) > 1]
@@ -0,0 +1,87 @@
+import time
+
+from detect_metrics import RollingWindow
+
+
+class AdaptiveResolution:
+    """Step the model input size (and display scale) to hold a per-frame latency target.
+
+    Levels run from the smallest input size to the largest. After every
+    window frames at a level the rolling mean latency is checked: above
+    target the controller steps down one level, below low_ratio * target it
+    steps up, but only if the next level's latency, estimated by scaling the
+    current one by the pixel ratio, still fits the target. The gap between
+    the two thresholds plus the settle period keep it from flapping between
+    neighbouring sizes. Every change is printed and kept in adjustments.
+    """
+
+    def __init__(self, target_ms, sizes=(320, 416, 512, 640), start_size=None, window=30,
+                 low_ratio=0.7, min_display_scale=0.5, scale_display=True):
+        if not sizes:
+            raise ValueError('Adaptive resolution needs at least one input size')
+        self.target = target_ms / 1000
+        self.sizes = sorted(sizes)
+        self.window_size = window
+        self.low_ratio = low_ratio
+        self.min_display_scale = min_display_scale
+        self.scale_display = scale_display
+
+        # Start at the largest size not above start_size (normally the size the model was trained at)
+        self.level = len(self.sizes) - 1
+        if start_size is not None:
+            fitting = [i for i, s in enumerate(self.sizes) if s <= start_size]
+            self.level = fitting[-1] if fitting else 0
+
+        self.window = RollingWindow(window)
+        self.adjustments = []
+        self._t_begin = time.perf_counter()
+
+    @property
+    def imgsz(self):
+        return self.sizes[self.level]
+
+    @property
+    def display_scale(self):
+        """Fraction of the display resolution frames are resized to at the current level."""
+        if not self.scale_display:
+            return 1.0
+        return max(self.min_display_scale, self.sizes[self.level] / self.sizes[-1])
+
+    def update(self, latency):
+        """Add one frame's latency (in seconds). Returns True if the level changed."""
+        self.window.add(latency)
+        if self.window.count < self.window_size:
+            return False
+
+        mean = self.window.mean
+        if mean > self.target and self.level > 0:
+            return self._step(-1, mean, f'latency {mean*1000:.1f} ms above target {self.target*1000:.1f} ms')
+        if mean < self.target * self.low_ratio and self.level < len(self.sizes) - 1:
+            next_size = self.sizes[self.level + 1]
+            estimate = mean * (next_size / self.imgsz) ** 2
+            if estimate < self.target:
+                return self._step(1, mean, f'latency {mean*1000:.1f} ms leaves room under target {self.target*1000:.1f} ms '
+                                           f'(about {estimate*1000:.1f} ms expected at {next_size})')
+        return False
+
+    def _step(self, direction, mean, reason):
+        old_size, old_scale = self.imgsz, self.display_scale
+        self.level += direction
+        self.adjustments.append({
+            'elapsed_s': time.perf_counter() - self._t_begin,
+            'latency_ms': mean * 1000,
+            'from': old_size,
+            'to': self.imgsz,
+            'display_scale': self.display_scale,
+        })
+        print(f'[adaptive {self.adjustments[-1]["elapsed_s"]:.1f}s] {reason}: imgsz {old_size} -> {self.imgsz}, '
+              f'display scale {old_scale:.2f} -> {self.display_scale:.2f}')
+
+        # Measure the new level from scratch so the old level's frames don't trigger another step
+        self.window = RollingWindow(self.window_size)
+        return True
+
+    def summary(self):
+        ups = sum(1 for a in self.adjustments if a['to'] > a['from'])
+        return (f'Adaptive resolution: {len(self.adjustments)} adjustments ({ups} up, {len(self.adjustments) - ups} down), '
+                f'finished at imgsz {self.imgsz}, display scale {self.display_scale:.2f}')
@@ -0,0 +1,170 @@
+import json
+import os
+import platform
+import time
+
+import numpy as np
+from ultralytics import YOLO
+
+from detect_metrics import LatencyHistogram
+
+
+BACKENDS = ['torch', 'onnx', 'openvino']
+
+
+def export_path(model_path, backend):
+    """Where Ultralytics writes the exported artifact for model_path (next to the weights)."""
+    stem = os.path.splitext(model_path)[0]
+    if backend == 'onnx':
+        return f'{stem}.onnx'
+    if backend == 'openvino':
+        return f'{stem}_openvino_model'
+    return model_path
+
+
+def export_model(pt_model, model_path, backend, imgsz):
+    """Export the .pt weights once and reuse the artifact until the weights change."""
+    artifact = export_path(model_path, backend)
+    if os.path.exists(artifact) and os.path.getmtime(artifact) >= os.path.getmtime(model_path):
+        return artifact
+
+    print(f'Exporting {model_path} to {backend} (imgsz={imgsz})...')
+    # dynamic=True keeps the batch dimension free so --batch and multi-stream inference still work
+    return pt_model.export(format=backend, imgsz=imgsz, dynamic=True)
+
+
+def configure_torch_threads(threads=None, interop_threads=None):
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        # Only allowed before the first parallel op runs, so this has to happen before the model is loaded
+        torch.set_num_interop_threads(interop_threads)
+
+
+class DetectorBackend:
+    """A YOLO model running on PyTorch, ONNX Runtime or OpenVINO.
+
+    Calling the backend forwards to the Ultralytics model and records how long
+    each forward pass took, so backends can be compared on the same host.
+    """
+
+    def __init__(self, model_path, backend='torch', threads=None, interop_threads=None):
+        if backend not in BACKENDS:
+            raise ValueError(f'Unsupported backend {backend}, expected one of {BACKENDS}')
+        self.backend = backend
+        self.threads = threads
+        self.interop_threads = interop_threads
+
+        if backend == 'torch':
+            configure_torch_threads(threads, interop_threads)
+
+        # Exported models should run at the size the network was trained at (stored in the checkpoint)
+        pt_model = YOLO(model_path, task='detect')
+        self.imgsz = pt_model.overrides.get('imgsz', 640)
+        self.model_path = model_path
+        if backend == 'torch':
+            self.artifact = model_path
+            self.model = pt_model
+        else:
+            self.artifact = export_model(pt_model, model_path, backend, self.imgsz)
+            self.model = YOLO(self.artifact, task='detect')
+        self.names = self.model.names
+
+        # Streaming histogram, so memory stays constant however long the detector runs
+        self.latency = LatencyHistogram()
+        self.frames = 0
+
+    def __call__(self, source, **kwargs):
+        kwargs.setdefault('imgsz', self.imgsz)
+        t_start = time.perf_counter()
+        results = self.model(source, **kwargs)
+        self.latency.add(time.perf_counter() - t_start)
+        self.frames += len(results)
+        return results
+
+    def _tune_session(self):
+        """Apply thread counts to the runtime session the Ultralytics predictor created."""
+        if not (self.threads or self.interop_threads) or self.backend == 'torch':
+            return
+        runtime = getattr(getattr(self.model, 'predictor', None), 'model', None)
+
+        if self.backend == 'onnx' and hasattr(runtime, 'session'):
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            if self.threads:
+                options.intra_op_num_threads = self.threads
+            if self.interop_threads:
+                options.inter_op_num_threads = self.interop_threads
+                options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+            runtime.session = onnxruntime.InferenceSession(self.artifact, options, providers=runtime.session.get_providers())
+
+        elif self.backend == 'openvino' and hasattr(runtime, 'ov_compiled_model'):
+            import openvino as ov
+            core = ov.Core()
+            xml = next(f for f in os.listdir(self.artifact) if f.endswith('.xml'))
+            config = {'INFERENCE_NUM_THREADS': self.threads} if self.threads else {}
+            if self.interop_threads:
+                config['NUM_STREAMS'] = self.interop_threads
+            runtime.ov_compiled_model = core.compile_model(core.read_model(os.path.join(self.artifact, xml)), 'CPU', config)
+
+        else:
+            print(f'WARNING: could not apply thread settings to the {self.backend} runtime; using its defaults.')
+
+    def warmup(self, shape, runs=2, **kwargs):
+        """Build the predictor, apply thread settings and run a few throwaway passes so the first real frame is not slow."""
+        dummy = np.zeros(shape, dtype=np.uint8)
+        kwargs.setdefault('verbose', False)
+        self.model(dummy, imgsz=self.imgsz, **kwargs)
+        self._tune_session()
+        for _ in range(runs):
+            self.model(dummy, imgsz=self.imgsz, **kwargs)
+
+    def summary(self):
+        """Latency and throughput of the forward passes made so far."""
+        if not self.latency.count:
+            return None
+        p50, p95 = self.latency.percentiles((50, 95))
+        return {
+            'calls': self.latency.count,
+            'frames': self.frames,
+            'latency_mean_ms': self.latency.total / self.latency.count * 1000,
+            'latency_p50_ms': p50 * 1000,
+            'latency_p95_ms': p95 * 1000,
+            'throughput_fps': self.frames / max(self.latency.total, 1e-9),
+            'threads': self.threads,
+            'interop_threads': self.interop_threads,
+        }
+
+
+def record_backend_stats(backend, stats_path=None):
+    """Store this run's summary for the current host and backend, and return every stored entry for the host.
+
+    Without stats_path nothing is written and only this run's summary is returned.
+    """
+    summary = backend.summary()
+    if stats_path is None:
+        return {backend.backend: summary} if summary else {}
+
+    stats = {}
+    if os.path.exists(stats_path):
+        with open(stats_path, 'r') as f:
+            stats = json.load(f)
+
+    host = platform.node() or 'localhost'
+    host_stats = stats.setdefault(host, {})
+    if summary:
+        host_stats[backend.backend] = summary
+        with open(stats_path, 'w') as f:
+            json.dump(stats, f, indent=2)
+    return host_stats
+
+
+def print_backend_comparison(host_stats):
+    """Print the stored backends for this host, fastest throughput first."""
+    if not host_stats:
+        return
+    print('\n--- Backend comparison (this host) ---')
+    print(f'{"backend":<10}{"mean ms":>10}{"p50 ms":>10}{"p95 ms":>10}{"FPS":>10}{"frames":>10}')
+    for name, s in sorted(host_stats.items(), key=lambda item: -item[1]['throughput_fps']):
+        print(f'{name:<10}{s["latency_mean_ms"]:>10.2f}{s["latency_p50_ms"]:>10.2f}{s["latency_p95_ms"]:>10.2f}{s["throughput_fps"]:>10.2f}{s["frames"]:>10}')
@@ -0,0 +1,167 @@
+import os
+import sys
+import argparse
+import glob
+import http.client
+import json
+import socket
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+img_ext_list = ['.jpg','.JPG','.jpeg','.JPEG','.png','.PNG','.bmp','.BMP']
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection that talks to a Unix socket instead of TCP."""
+
+    def __init__(self, socket_path, timeout=30):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def open_connection(args):
+    if args.unix_socket:
+        return UnixHTTPConnection(args.unix_socket)
+    return http.client.HTTPConnection(args.host, args.port, timeout=30)
+
+
+def load_frames(args):
+    """Read up to --max_frames test frames from an image folder or a video file."""
+    frames = []
+    if os.path.isdir(args.source):
+        for path in sorted(glob.glob(os.path.join(args.source, '*'))):
+            if os.path.splitext(path)[1] in img_ext_list:
+                frame = cv2.imread(path)
+                if frame is not None:
+                    frames.append(frame)
+            if len(frames) >= args.max_frames:
+                break
+    else:
+        cap = cv2.VideoCapture(args.source)
+        while len(frames) < args.max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+
+    if args.resolution:
+        resW, resH = int(args.resolution.split('x')[0]), int(args.resolution.split('x')[1])
+        frames = [cv2.resize(frame, (resW, resH)) for frame in frames]
+    return frames
+
+
+def encode_payloads(frames, raw):
+    """Pre-encode every request body so the client measures the service, not its own JPEG encoder."""
+    payloads = []
+    for frame in frames:
+        if raw:
+            headers = {'Content-Type': 'application/octet-stream',
+                       'X-Frame-Width': str(frame.shape[1]), 'X-Frame-Height': str(frame.shape[0])}
+            payloads.append((np.ascontiguousarray(frame).tobytes(), headers))
+        else:
+            ok, encoded = cv2.imencode('.jpg', frame)
+            payloads.append((encoded.tobytes(), {'Content-Type': 'image/jpeg'}))
+    return payloads
+
+
+def worker(args, payloads, offset, deadline, latencies, errors, lock):
+    conn = open_connection(args)
+    i = offset
+    local_latencies = []
+    local_errors = 0
+    while time.perf_counter() < deadline:
+        body, headers = payloads[i % len(payloads)]
+        i += 1
+        t_start = time.perf_counter()
+        try:
+            conn.request('POST', '/detect', body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                local_errors += 1
+                continue
+        except (OSError, http.client.HTTPException):
+            local_errors += 1
+            conn.close()
+            conn = open_connection(args)
+            continue
+        local_latencies.append(time.perf_counter() - t_start)
+    conn.close()
+
+    with lock:
+        latencies.extend(local_latencies)
+        errors.append(local_errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator for detect_service.py: measures throughput and latency under concurrent requests.')
+    parser.add_argument('--source', required=True, help='Image folder or video file to take test frames from')
+    parser.add_argument('--host', default='127.0.0.1', help='Service address (default: 127.0.0.1)')
+    parser.add_argument('--port', default=8000, type=int, help='Service TCP port (default: 8000)')
+    parser.add_argument('--unix_socket', default=None, help='Connect to this Unix socket instead of TCP')
+    parser.add_argument('--concurrency', default=8, type=int, help='Number of clients sending requests at the same time')
+    parser.add_argument('--duration', default=20.0, type=float, help='Seconds to run the test for')
+    parser.add_argument('--budget_ms', default=100.0, type=float, help='Per-request latency budget to report against')
+    parser.add_argument('--max_frames', default=64, type=int, help='Number of distinct test frames to cycle through')
+    parser.add_argument('--resolution', default=None, help='Resize test frames to WxH before sending (example: "1280x720")')
+    parser.add_argument('--raw', action='store_true', help='Send raw BGR frames instead of JPEG-encoded images')
+
+    args = parser.parse_args()
+
+    frames = load_frames(args)
+    if not frames:
+        print(f'No frames could be read from {args.source}. Please try again.')
+        sys.exit(0)
+    payloads = encode_payloads(frames, args.raw)
+    print(f'Loaded {len(payloads)} test frames, running {args.concurrency} clients for {args.duration:.0f} s...')
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    t_begin = time.perf_counter()
+    deadline = t_begin + args.duration
+    threads = [threading.Thread(target=worker, args=(args, payloads, n, deadline, latencies, errors, lock))
+               for n in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - t_begin
+
+    if not latencies:
+        print(f'No successful requests ({sum(errors)} errors). Is the service running?')
+        sys.exit(0)
+
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    within = np.mean(latencies_ms <= args.budget_ms) * 100
+
+    print('\n--- RESULTS ---')
+    print(f'requests: {len(latencies)} ok, {sum(errors)} errors')
+    print(f'throughput: {len(latencies)/elapsed:.2f} frames/s')
+    print(f'latency ms: mean {latencies_ms.mean():.1f}, p50 {p50:.1f}, p95 {p95:.1f}, p99 {p99:.1f}, max {latencies_ms.max():.1f}')
+    print(f'within {args.budget_ms:.0f} ms budget: {within:.1f}%')
+
+    # Batching counters from the service, to see how much grouping the load produced
+    try:
+        conn = open_connection(args)
+        conn.request('GET', '/stats')
+        stats = json.loads(conn.getresponse().read())
+        conn.close()
+        print(f'service: {stats["batches"]} batches, {stats["avg_batch_size"]:.2f} frames per batch, {stats["avg_batch_ms"]:.1f} ms per batch')
+    except (OSError, http.client.HTTPException, ValueError):
+        pass
+
+
+if __name__ == '__main__':
+    main()
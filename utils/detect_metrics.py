@@ -0,0 +1,224 @@
+import math
+import os
+import time
+
+
+class RollingWindow:
+    """Mean of the last size values in constant time per update.
+
+    The running sum is recomputed from scratch each time the ring buffer wraps,
+    so floating point drift from add/subtract never builds up.
+    """
+
+    def __init__(self, size=200):
+        self.size = size
+        self.values = [0.0] * size
+        self.index = 0
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        if self.count == self.size:
+            self.total -= self.values[self.index]
+        else:
+            self.count += 1
+        self.values[self.index] = value
+        self.total += value
+        self.index += 1
+        if self.index == self.size:
+            self.index = 0
+            self.total = sum(self.values)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class LatencyHistogram:
+    """Streaming percentiles from log-spaced buckets (about 3.5% relative error).
+
+    Memory and update cost are constant no matter how long the detector runs,
+    unlike keeping every sample and sorting it.
+    """
+
+    def __init__(self, min_value=1e-5, max_value=10.0, buckets=400):
+        self.min_value = min_value
+        self.buckets = buckets
+        self._log_min = math.log(min_value)
+        self._log_step = (math.log(max_value) - self._log_min) / buckets
+        self.counts = [0] * (buckets + 2)  # plus underflow and overflow buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        if value < self.min_value:
+            idx = 0
+        else:
+            idx = min(int((math.log(value) - self._log_min) / self._log_step) + 1, self.buckets + 1)
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def _bucket_value(self, idx):
+        if idx == 0:
+            return self.min_value
+        if idx > self.buckets:
+            return self.max
+        # Geometric middle of the bucket
+        return math.exp(self._log_min + (idx - 0.5) * self._log_step)
+
+    def percentiles(self, ps):
+        """Values at the given percentiles (0-100), computed in one pass over the buckets."""
+        if not self.count:
+            return [0.0 for _ in ps]
+        targets = sorted((p / 100 * self.count, i) for i, p in enumerate(ps))
+        out = [0.0] * len(ps)
+        seen = 0
+        t = 0
+        for idx, c in enumerate(self.counts):
+            seen += c
+            while t < len(targets) and seen >= targets[t][0] and c:
+                out[targets[t][1]] = min(self._bucket_value(idx), self.max)
+                t += 1
+            if t == len(targets):
+                break
+        return out
+
+
+class StageStats:
+    def __init__(self, window=200):
+        self.window = RollingWindow(window)
+        self.histogram = LatencyHistogram()
+
+    def add(self, seconds):
+        self.window.add(seconds)
+        self.histogram.add(seconds)
+
+
+class _StageTimer:
+    __slots__ = ('profiler', 'name', 't_start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.t_start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.t_start)
+        return False
+
+
+class Profiler:
+    """Per-stage latency statistics with periodic export.
+
+    Wrap each stage in "with profiler.stage('inference'):". Every stage keeps
+    a rolling window (for the recent mean) and a streaming histogram (for
+    p50/p95/p99 over the whole run). If export_path is set, maybe_export()
+    writes the current numbers every export_interval seconds as CSV rows or a
+    Prometheus text-format file (for the node_exporter textfile collector).
+    """
+
+    percentiles = (50, 95, 99)
+
+    def __init__(self, stages=(), window=200, export_path=None, export_format='csv', export_interval=5.0):
+        if export_format not in ('csv', 'prom'):
+            raise ValueError(f'Unsupported metrics format {export_format}, expected "csv" or "prom"')
+        self.window = window
+        self.stats = {name: StageStats(window) for name in stages}
+        self.export_path = export_path
+        self.export_format = export_format
+        self.export_interval = export_interval
+        self._last_export = time.perf_counter()
+        self._csv_header_written = False
+
+    def stage(self, name):
+        return _StageTimer(self, name)
+
+    def add(self, name, seconds):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats.setdefault(name, StageStats(self.window))
+        stats.add(seconds)
+
+    def rows(self):
+        """One dict per stage with count, recent mean and percentiles in milliseconds."""
+        rows = []
+        for name, stats in self.stats.items():
+            hist = stats.histogram
+            if not hist.count:
+                continue
+            p50, p95, p99 = hist.percentiles(self.percentiles)
+            rows.append({
+                'stage': name,
+                'count': hist.count,
+                'mean_ms': hist.total / hist.count * 1000,
+                'recent_mean_ms': stats.window.mean * 1000,
+                'p50_ms': p50 * 1000,
+                'p95_ms': p95 * 1000,
+                'p99_ms': p99 * 1000,
+                'max_ms': hist.max * 1000,
+            })
+        return rows
+
+    def maybe_export(self):
+        if self.export_path is None:
+            return
+        now = time.perf_counter()
+        if now - self._last_export >= self.export_interval:
+            self._last_export = now
+            self.export()
+
+    def export(self):
+        if self.export_path is None:
+            return
+        if self.export_format == 'csv':
+            self._export_csv()
+        else:
+            self._export_prometheus()
+
+    def _export_csv(self):
+        columns = ['timestamp', 'stage', 'count', 'mean_ms', 'recent_mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+        timestamp = time.time()
+        write_header = not self._csv_header_written and not os.path.exists(self.export_path)
+        with open(self.export_path, 'a') as f:
+            if write_header:
+                f.write(','.join(columns) + '\n')
+            for row in self.rows():
+                row['timestamp'] = timestamp
+                f.write(','.join(f'{row[c]:.3f}' if isinstance(row[c], float) else str(row[c]) for c in columns) + '\n')
+        self._csv_header_written = True
+
+    def _export_prometheus(self):
+        lines = [
+            '# HELP yolo_detect_stage_latency_seconds Latency of each detector stage.',
+            '# TYPE yolo_detect_stage_latency_seconds summary',
+        ]
+        for name, stats in self.stats.items():
+            hist = stats.histogram
+            if not hist.count:
+                continue
+            for p, value in zip(self.percentiles, hist.percentiles(self.percentiles)):
+                lines.append(f'yolo_detect_stage_latency_seconds{{stage="{name}",quantile="{p/100}"}} {value:.6f}')
+            lines.append(f'yolo_detect_stage_latency_seconds_sum{{stage="{name}"}} {hist.total:.6f}')
+            lines.append(f'yolo_detect_stage_latency_seconds_count{{stage="{name}"}} {hist.count}')
+
+        # Write to a temporary file and rename, so a scraper never reads a half-written file
+        tmp_path = self.export_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.export_path)
+
+    def print_summary(self):
+        rows = self.rows()
+        if not rows:
+            return
+        print('\n--- Stage latency (ms) ---')
+        print(f'{"stage":<14}{"count":>8}{"mean":>9}{"recent":>9}{"p50":>9}{"p95":>9}{"p99":>9}{"max":>9}')
+        for r in rows:
+            print(f'{r["stage"]:<14}{r["count"]:>8}{r["mean_ms"]:>9.2f}{r["recent_mean_ms"]:>9.2f}{r["p50_ms"]:>9.2f}{r["p95_ms"]:>9.2f}{r["p99_ms"]:>9.2f}{r["max_ms"]:>9.2f}')
@@ -0,0 +1,81 @@
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Decide per frame whether the scene changed enough to be worth running the model.
+
+    Frames are shrunk to a small grayscale thumbnail and compared either with
+    the thumbnail of the last frame that went through the model ("diff") or
+    with a MOG2 background model ("mog2"). The score is the fraction of
+    changed pixels. Frames scoring below threshold are skipped and reuse the
+    last detections, but at most refresh_every frames in a row, so stale
+    results are bounded.
+    """
+
+    def __init__(self, threshold=0.01, refresh_every=30, method='diff', thumb_width=160, pixel_delta=25):
+        if method not in ('diff', 'mog2'):
+            raise ValueError(f'Unsupported motion method {method}, expected "diff" or "mog2"')
+        self.threshold = threshold
+        self.refresh_every = refresh_every
+        self.method = method
+        self.thumb_width = thumb_width
+        self.pixel_delta = pixel_delta
+
+        self._reference = None
+        self._subtractor = cv2.createBackgroundSubtractorMOG2(history=300, detectShadows=False) if method == 'mog2' else None
+        self._since_refresh = 0
+
+        self.frames = 0
+        self.skipped = 0
+        self.inference_time = 0.0
+        self.inferred = 0
+
+    def _thumbnail(self, frame):
+        h, w = frame.shape[:2]
+        thumb_h = max(1, int(h * self.thumb_width / w))
+        small = cv2.resize(frame, (self.thumb_width, thumb_h), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def score(self, thumb):
+        """Fraction of thumbnail pixels that changed."""
+        if self.method == 'mog2':
+            mask = self._subtractor.apply(thumb)
+            return np.count_nonzero(mask) / mask.size
+        if self._reference is None or self._reference.shape != thumb.shape:
+            return 1.0
+        diff = cv2.absdiff(thumb, self._reference)
+        return np.count_nonzero(diff > self.pixel_delta) / diff.size
+
+    def should_infer(self, frame):
+        """Return True if the model should run on this frame."""
+        self.frames += 1
+        thumb = self._thumbnail(frame)
+        moving = self.score(thumb) >= self.threshold
+
+        # The first frame always runs so there are detections to reuse
+        if moving or self._reference is None or self._since_refresh >= self.refresh_every:
+            self._reference = thumb
+            self._since_refresh = 0
+            return True
+
+        self._since_refresh += 1
+        self.skipped += 1
+        return False
+
+    def record_inference(self, seconds, frames=1):
+        """Track model time so the time saved by skipped frames can be estimated."""
+        self.inference_time += seconds
+        self.inferred += frames
+
+    def summary(self):
+        skip_ratio = self.skipped / self.frames if self.frames else 0.0
+        avg_inference = self.inference_time / self.inferred if self.inferred else 0.0
+        return {
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'skip_ratio': skip_ratio,
+            'time_saved_s': self.skipped * avg_inference,
+        }
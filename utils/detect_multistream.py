@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+
+import cv2
+
+from detect_pipeline import FrameQueue
+
+
+vid_ext_list = ['.avi','.mov','.mp4','.mkv','.wmv']
+
+
+def parse_stream_source(source):
+    """Return (capture argument, is_live) for a usb index ("usb0"), a video file or a stream URL."""
+    if source.startswith('usb'):
+        return int(source[3:]), True
+    if os.path.isfile(source):
+        _, ext = os.path.splitext(source)
+        if ext.lower() not in vid_ext_list:
+            raise ValueError(f'File extension {ext} is not supported.')
+        return source, False
+    if '://' in source:
+        return source, True
+    raise ValueError(f'Input {source} is invalid.')
+
+
+class StreamReader:
+    """Read one source on its own thread into a bounded FrameQueue.
+
+    Live sources keep only the newest frame; video files are read losslessly
+    with a few frames of look-ahead.
+    """
+
+    def __init__(self, stream_id, source, stop_event, resolution=None):
+        self.stream_id = stream_id
+        self.source = source
+        self.stop_event = stop_event
+        self.resolution = resolution
+
+        cap_arg, self.live = parse_stream_source(source)
+        self.cap = cv2.VideoCapture(cap_arg)
+        if resolution and self.live:
+            self.cap.set(3, resolution[0])
+            self.cap.set(4, resolution[1])
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        self.frames = FrameQueue(maxsize=1 if self.live else 4, drop_oldest=self.live)
+        self.finished = False
+        self.frames_read = 0
+        self._thread = threading.Thread(target=self._read_loop, name=f'stream{stream_id}', daemon=True)
+
+    def _read_loop(self):
+        while not self.stop_event.is_set():
+            ret, frame = self.cap.read()
+            if not ret or frame is None:
+                break
+            if self.resolution:
+                frame = cv2.resize(frame, self.resolution)
+            if not self.frames.put((self.frames_read, frame), self.stop_event):
+                break
+            self.frames_read += 1
+        self.finished = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def join(self):
+        self._thread.join(timeout=2)
+        self.cap.release()
+
+
+class StreamMultiplexer:
+    """Collect frames from several StreamReaders into fair inference batches.
+
+    Each batch takes at most one frame per stream, and the stream served first
+    rotates from batch to batch, so a fast source cannot starve the others when
+    max_batch is smaller than the number of streams.
+    """
+
+    def __init__(self, readers, max_batch=None, poll_interval=0.002):
+        self.readers = readers
+        self.max_batch = max_batch or len(readers)
+        self.poll_interval = poll_interval
+        self._next_stream = 0
+
+    @property
+    def exhausted(self):
+        return all(reader.finished and reader.frames.empty() for reader in self.readers)
+
+    def next_batch(self):
+        """Return a list of (stream_id, frame_idx, frame), or an empty list once every stream is exhausted."""
+        while not self.exhausted:
+            batch = []
+            n = len(self.readers)
+            for offset in range(n):
+                reader = self.readers[(self._next_stream + offset) % n]
+                item = reader.frames.poll()
+                if item is not None:
+                    frame_idx, frame = item
+                    batch.append((reader.stream_id, frame_idx, frame))
+                    if len(batch) >= self.max_batch:
+                        break
+            if batch:
+                self._next_stream = (self._next_stream + 1) % n
+                return batch
+            time.sleep(self.poll_interval)
+        return []
+
+
+class StreamSink:
+    """Per-stream output: display window or detection records, optional recorder, and counters."""
+
+    def __init__(self, stream_id, source, recorder=None):
+        self.stream_id = stream_id
+        self.source = source
+        self.recorder = recorder
+        self.window_name = f'YOLO detection results - stream {stream_id}'
+        self.frames = 0
+        self.objects = 0
+        self.t_first = None
+        self.t_last = None
+
+    def update(self, object_count):
+        t_now = time.perf_counter()
+        if self.t_first is None:
+            self.t_first = t_now
+        self.t_last = t_now
+        self.frames += 1
+        self.objects += object_count
+
+    @property
+    def frame_rate(self):
+        if self.frames < 2:
+            return 0.0
+        return (self.frames - 1) / (self.t_last - self.t_first)
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.release()
+            print(f'Stream {self.stream_id}: {self.recorder.summary()}')
@@ -0,0 +1,142 @@
+import json
+import struct
+
+import numpy as np
+
+from detect_postprocess import Detections
+
+
+# Binary record layout: a file header, then per frame a frame header, the UTF-8 source name,
+# its boxes and, when the frame has track ids, one int32 track id per box
+BINARY_MAGIC = b'YDET'
+BINARY_VERSION = 2
+FILE_HEADER = struct.Struct('<4sH')
+FRAME_HEADER = struct.Struct('<dqIHB')  # timestamp, frame index, object count, source name length, has track ids
+BOX_DTYPE = np.dtype([('xyxy', '<i4', (4,)), ('conf', '<f4'), ('cls', '<i4')])
+TRACK_ID_DTYPE = np.dtype('<i4')
+
+
+def detection_record(timestamp, frame_idx, detections, source=None):
+    """Structured detections of one frame: timestamp, frame, count, boxes, classes, confidences (and track_ids, source when known)."""
+    record = {
+        'timestamp': round(timestamp, 6),
+        'frame': frame_idx,
+        'count': len(detections),
+        'boxes': detections.xyxy.tolist(),
+        'classes': detections.cls.tolist(),
+        # float32 values would serialize with float32 noise (0.8999999761581421), so round in float64
+        'confidences': np.round(detections.conf.astype(np.float64), 4).tolist(),
+    }
+    if detections.track_ids is not None:
+        record['track_ids'] = detections.track_ids.tolist()
+    if source is not None:
+        record['source'] = source
+    return record
+
+
+class DetectionWriter:
+    """Buffer per-frame detection records and write them in batches.
+
+    Records are kept in memory and written every flush_every frames, so the
+    hot loop never blocks on a small write.
+    """
+
+    mode = 'w'
+
+    def __init__(self, path, flush_every=64):
+        self.path = path
+        self.flush_every = flush_every
+        self._buffer = []
+        self._file = open(path, self.mode)
+        self.frames_written = 0
+
+    def write(self, timestamp, frame_idx, detections, source=None):
+        self._buffer.append(self.encode(timestamp, frame_idx, detections, source))
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def encode(self, timestamp, frame_idx, detections, source):
+        raise NotImplementedError
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(self._join(self._buffer))
+            self.frames_written += len(self._buffer)
+            self._buffer = []
+        self._file.flush()
+
+    def _join(self, records):
+        return ''.join(records)
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class JsonlDetectionWriter(DetectionWriter):
+    """One JSON object per line, as built by detection_record()."""
+
+    def encode(self, timestamp, frame_idx, detections, source):
+        return json.dumps(detection_record(timestamp, frame_idx, detections, source), separators=(',', ':')) + '\n'
+
+
+class BinaryDetectionWriter(DetectionWriter):
+    """Compact little-endian record file, read back with read_binary_detections()."""
+
+    mode = 'wb'
+
+    def __init__(self, path, flush_every=64):
+        super().__init__(path, flush_every)
+        self._file.write(FILE_HEADER.pack(BINARY_MAGIC, BINARY_VERSION))
+
+    def encode(self, timestamp, frame_idx, detections, source):
+        boxes = np.empty(len(detections), dtype=BOX_DTYPE)
+        boxes['xyxy'] = detections.xyxy
+        boxes['conf'] = detections.conf
+        boxes['cls'] = detections.cls
+        name = source.encode('utf-8') if source is not None else b''
+        has_tracks = detections.track_ids is not None
+        record = FRAME_HEADER.pack(timestamp, frame_idx, len(detections), len(name), has_tracks) + name + boxes.tobytes()
+        if has_tracks:
+            record += np.asarray(detections.track_ids, dtype=TRACK_ID_DTYPE).tobytes()
+        return record
+
+    def _join(self, records):
+        return b''.join(records)
+
+
+OUTPUT_FORMATS = {
+    'jsonl': JsonlDetectionWriter,
+    'bin': BinaryDetectionWriter,
+}
+
+
+def open_detection_writer(path, output_format=None, flush_every=64):
+    """Create a writer for path. The format defaults to the file extension ("jsonl" or "bin")."""
+    if output_format is None:
+        output_format = 'bin' if str(path).endswith('.bin') else 'jsonl'
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unsupported output format {output_format}, expected one of {list(OUTPUT_FORMATS)}')
+    return OUTPUT_FORMATS[output_format](path, flush_every=flush_every)
+
+
+def read_binary_detections(path):
+    """Yield (timestamp, frame_idx, Detections, source) tuples from a binary record file.
+
+    source is None when the frame was written without one, and
+    Detections.track_ids is None when the frame had no track ids.
+    """
+    with open(path, 'rb') as f:
+        magic, version = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError(f'{path} is not a version {BINARY_VERSION} detection record file')
+
+        while True:
+            header = f.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            timestamp, frame_idx, count, name_len, has_tracks = FRAME_HEADER.unpack(header)
+            source = f.read(name_len).decode('utf-8') if name_len else None
+            boxes = np.frombuffer(f.read(count * BOX_DTYPE.itemsize), dtype=BOX_DTYPE)
+            track_ids = np.frombuffer(f.read(count * TRACK_ID_DTYPE.itemsize), dtype=TRACK_ID_DTYPE) if has_tracks else None
+            yield timestamp, frame_idx, Detections(boxes['xyxy'], boxes['conf'], boxes['cls'], track_ids), source
@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+
+
+# Marker pushed through the queues once the capture stage runs out of frames
+_END = object()
+
+
+class FrameQueue:
+    """Bounded queue joining two pipeline stages.
+
+    With drop_oldest=True a put on a full queue discards the oldest item
+    ("latest frame wins", used for live cameras). Otherwise put blocks until
+    the consumer catches up, so no frame is lost (used for video files).
+    """
+
+    def __init__(self, maxsize=1, drop_oldest=False):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.drop_oldest = drop_oldest
+        self.dropped = 0
+
+    def put(self, item, stop_event):
+        while not stop_event.is_set():
+            if self.drop_oldest:
+                try:
+                    self._queue.put_nowait(item)
+                    return True
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+            else:
+                try:
+                    self._queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+        return False
+
+    def get(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def poll(self):
+        """Return the next item without waiting, or None if the queue is empty."""
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def empty(self):
+        return self._queue.empty()
+
+
+class DetectionPipeline:
+    """Run capture and inference on worker threads, yield results to the caller.
+
+    capture() returns the next (frame_ref, frame) pair or None when the source
+    is exhausted. infer(frame) returns the model results for that frame.
+    Iterating over the pipeline yields (frame_ref, frame, results, t_capture)
+    tuples on the calling thread, which is where display and recording should
+    happen (cv2.imshow must stay on the main thread). An exception raised by
+    capture() or infer() stops the pipeline and is re-raised from the loop.
+    """
+
+    def __init__(self, capture, infer, drop_frames=True, queue_size=1):
+        self.capture = capture
+        self.infer = infer
+        self.frames = FrameQueue(queue_size, drop_oldest=drop_frames)
+        self.outputs = FrameQueue(queue_size, drop_oldest=drop_frames)
+        self.stop_event = threading.Event()
+        self.error = None
+        self._threads = [
+            threading.Thread(target=self._run, args=(self._capture_loop,), name='capture', daemon=True),
+            threading.Thread(target=self._run, args=(self._inference_loop,), name='inference', daemon=True),
+        ]
+
+    def _run(self, loop):
+        try:
+            loop()
+        except BaseException as e:
+            # Keep the first failure and stop both stages; __iter__ re-raises it on the main thread
+            if self.error is None:
+                self.error = e
+            self.stop_event.set()
+
+    def _capture_loop(self):
+        while not self.stop_event.is_set():
+            item = self.capture()
+            if item is None:
+                break
+            frame_ref, frame = item
+            if not self.frames.put((frame_ref, frame, time.perf_counter()), self.stop_event):
+                return
+        self._finish(self.frames)
+
+    def _inference_loop(self):
+        while not self.stop_event.is_set():
+            item = self.frames.get(self.stop_event)
+            if item is _END:
+                break
+            frame_ref, frame, t_capture = item
+            results = self.infer(frame)
+            if not self.outputs.put((frame_ref, frame, results, t_capture), self.stop_event):
+                return
+        self._finish(self.outputs)
+
+    def _finish(self, frame_queue):
+        # The end marker must never be dropped, so push it with a blocking put
+        frame_queue.drop_oldest = False
+        frame_queue.put(_END, self.stop_event)
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout=2)
+
+    @property
+    def dropped(self):
+        return self.frames.dropped + self.outputs.dropped
+
+    def __iter__(self):
+        while True:
+            item = self.outputs.get(self.stop_event)
+            if item is _END:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
@@ -0,0 +1,144 @@
+import cv2
+import numpy as np
+
+
+# Bounding box colors (using the Tableu 10 color scheme)
+BBOX_COLORS = [(164,120,87), (68,148,228), (93,97,209), (178,182,133), (88,159,106),
+               (96,202,231), (159,124,168), (169,162,241), (98,118,150), (172,176,184)]
+
+
+class Detections:
+    """Host-side detections for one frame.
+
+    xyxy is an (N, 4) int32 array of pixel coordinates, conf an (N,) float32
+    array and cls an (N,) int32 array of class indices. track_ids is an (N,)
+    int array when the detections come from the tracker, otherwise None.
+    """
+
+    __slots__ = ('xyxy', 'conf', 'cls', 'track_ids')
+
+    def __init__(self, xyxy, conf, cls, track_ids=None):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+        self.track_ids = track_ids
+
+    def __len__(self):
+        return len(self.conf)
+
+    def __getitem__(self, mask):
+        """Select detections with a boolean mask or index array."""
+        track_ids = self.track_ids[mask] if self.track_ids is not None else None
+        return Detections(self.xyxy[mask], self.conf[mask], self.cls[mask], track_ids)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros((0, 4), dtype=np.int32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int32))
+
+
+def extract_detections(boxes, min_thresh=0.5):
+    """Convert an Ultralytics Boxes object to Detections above min_thresh.
+
+    boxes.data holds xyxy, (track id,) conf and cls in one tensor, so the whole
+    frame is moved to host memory in a single transfer and filtered with a
+    NumPy mask instead of per-box .item() calls.
+    """
+    data = boxes.data
+    if hasattr(data, 'cpu'):
+        data = data.cpu().numpy()
+    data = np.asarray(data, dtype=np.float32)
+    if data.size == 0:
+        return Detections.empty()
+
+    data = data[data[:, -2] > min_thresh]
+    return Detections(data[:, :4].astype(np.int32), data[:, -2], data[:, -1].astype(np.int32))
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Pairwise IoU between (N, 4) and (M, 4) xyxy boxes, as an (N, M) array."""
+    boxes_a = np.asarray(boxes_a, dtype=np.float32)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32)
+    if len(boxes_a) == 0 or len(boxes_b) == 0:
+        return np.zeros((len(boxes_a), len(boxes_b)), dtype=np.float32)
+
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def nms(detections, iou_thresh=0.5):
+    """Class-aware non-maximum suppression over Detections, using one IoU matrix for all boxes."""
+    if len(detections) < 2:
+        return detections
+
+    # Shift each class to its own region so boxes of different classes never overlap
+    offset = detections.cls.astype(np.float32)[:, None] * (float(detections.xyxy.max()) + 1)
+    iou = iou_matrix(detections.xyxy + offset, detections.xyxy + offset)
+
+    order = np.argsort(-detections.conf)
+    suppressed = np.zeros(len(detections), dtype=bool)
+    keep = []
+    for i in order.tolist():
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= iou[i] > iou_thresh
+    return detections[np.array(keep, dtype=np.int64)]
+
+
+class Annotator:
+    """Draws detections on frames, caching label text and its rendered size.
+
+    Labels only change with the class, the confidence percentage shown on
+    screen and the track ID (if any), so cv2.getTextSize is called once per
+    combination.
+    """
+
+    max_cached_labels = 4096
+
+    def __init__(self, labels, colors=BBOX_COLORS, font_scale=0.5):
+        self.labels = labels
+        self.colors = colors
+        self.font_scale = font_scale
+        self._label_cache = {}
+
+    def _label(self, classidx, conf_pct, track_id=None):
+        key = (classidx, conf_pct, track_id)
+        cached = self._label_cache.get(key)
+        if cached is None:
+            # Track IDs keep growing on long runs, so keep the cache bounded
+            if len(self._label_cache) >= self.max_cached_labels:
+                self._label_cache.clear()
+            if track_id is None:
+                label = f'{self.labels[classidx]}: {conf_pct}%'
+            else:
+                label = f'{self.labels[classidx]} #{track_id}: {conf_pct}%'
+            labelSize, baseLine = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, self.font_scale, 1) # Get font size
+            cached = (label, labelSize, baseLine)
+            self._label_cache[key] = cached
+        return cached
+
+    def draw(self, frame, detections):
+        """Draw boxes and labels on the frame and return the number of objects drawn."""
+        conf_pcts = (detections.conf * 100).astype(np.int32)
+        if detections.track_ids is not None:
+            track_ids = detections.track_ids.tolist()
+        else:
+            track_ids = [None] * len(detections)
+
+        for (xmin, ymin, xmax, ymax), classidx, conf_pct, track_id in zip(detections.xyxy.tolist(), detections.cls.tolist(), conf_pcts.tolist(), track_ids):
+            color = self.colors[(classidx if track_id is None else track_id) % len(self.colors)]
+            cv2.rectangle(frame, (xmin,ymin), (xmax,ymax), color, 2)
+
+            label, labelSize, baseLine = self._label(classidx, conf_pct, track_id)
+            label_ymin = max(ymin, labelSize[1] + 10) # Make sure not to draw label too close to top of window
+            cv2.rectangle(frame, (xmin, label_ymin-labelSize[1]-10), (xmin+labelSize[0], label_ymin+baseLine-10), color, cv2.FILLED) # Draw white box to put label text in
+            cv2.putText(frame, label, (xmin, label_ymin-7), cv2.FONT_HERSHEY_SIMPLEX, self.font_scale, (0, 0, 0), 1) # Draw label text
+
+        return len(detections)
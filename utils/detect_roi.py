@@ -0,0 +1,145 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+from detect_postprocess import Detections, extract_detections, nms
+
+
+ROI_MODES = ('crop', 'batch')
+
+
+def load_roi_config(path, source):
+    """Read the regions of interest for source from a JSON config file.
+
+    The file maps a source (as passed to --source, or just its file name) or
+    "default" to a list of regions. A region is either a rectangle
+    [x1, y1, x2, y2] or a polygon [[x, y], [x, y], ...], in display pixels:
+
+        {"usb0": [[0, 200, 1280, 720]],
+         "platform.mp4": [[[100, 300], [1200, 280], [1280, 720], [0, 720]]],
+         "default": [[0, 0, 1280, 720]]}
+
+    Returns a list of (N, 2) int32 point arrays.
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    for key in (source, os.path.basename(source), 'default'):
+        if key in config:
+            regions = config[key]
+            break
+    else:
+        raise ValueError(f'No regions of interest for {source} (and no "default" entry) in {path}')
+
+    polygons = []
+    for region in regions:
+        points = np.asarray(region, dtype=np.float64)
+        if points.shape == (4,):
+            x1, y1, x2, y2 = points
+            points = np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
+        if points.ndim != 2 or points.shape[1] != 2 or len(points) < 3:
+            raise ValueError(f'Region {region} in {path} is neither a rectangle [x1, y1, x2, y2] nor a polygon [[x, y], ...]')
+        polygons.append(points.round().astype(np.int32))
+    if not polygons:
+        raise ValueError(f'The region list for {source} in {path} is empty')
+    return polygons
+
+
+class RoiDetector:
+    """Run the model only on the parts of the frame inside the regions of interest.
+
+    In "crop" mode the model sees one crop: the bounding box of all regions
+    together. In "batch" mode each region's bounding box is a separate crop
+    and all crops go through the model as one batch, which saves more pixels
+    when the regions are far apart. Boxes are shifted back to frame
+    coordinates, and boxes whose center falls outside every region are
+    dropped with a single lookup into a precomputed mask.
+
+    Region coordinates refer to a base_size (w, h) frame. If frames arrive at
+    another size (for example when the adaptive controller scales the
+    display), the regions and mask are rescaled once per size change.
+    """
+
+    def __init__(self, model, polygons, mode='crop', min_thresh=0.5, nms_iou=0.5, base_size=None):
+        if mode not in ROI_MODES:
+            raise ValueError(f'Unsupported ROI mode {mode}, expected one of {", ".join(ROI_MODES)}')
+        self.model = model
+        self.polygons = polygons
+        self.mode = mode
+        self.min_thresh = min_thresh
+        self.nms_iou = nms_iou
+        self.base_size = base_size
+
+        self._shape = None
+        self._mask = None
+        self._crops = None
+
+        self.pixels_in = 0
+        self.pixels_total = 0
+
+    def _layout(self, frame):
+        h, w = frame.shape[:2]
+        if self._shape == (h, w):
+            return
+        polygons = self.polygons
+        if self.base_size is not None and tuple(self.base_size) != (w, h):
+            scale = np.array([w / self.base_size[0], h / self.base_size[1]])
+            polygons = [(p * scale).round().astype(np.int32) for p in polygons]
+
+        self._mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.fillPoly(self._mask, polygons, 1)
+
+        boxes = []
+        for p in polygons:
+            x0, y0 = np.clip(p.min(axis=0), 0, [w, h])
+            x1, y1 = np.clip(p.max(axis=0) + 1, 0, [w, h])
+            if x1 > x0 and y1 > y0:
+                boxes.append((int(x0), int(y0), int(x1), int(y1)))
+        if self.mode == 'crop' and boxes:
+            b = np.array(boxes)
+            boxes = [(int(b[:, 0].min()), int(b[:, 1].min()), int(b[:, 2].max()), int(b[:, 3].max()))]
+        self._crops = boxes
+        self._shape = (h, w)
+
+    def _inside(self, detections):
+        """Keep detections whose box center lies inside a region."""
+        if not len(detections):
+            return detections
+        h, w = self._shape
+        xyxy = detections.xyxy
+        cx = np.clip((xyxy[:, 0] + xyxy[:, 2]) // 2, 0, w - 1)
+        cy = np.clip((xyxy[:, 1] + xyxy[:, 3]) // 2, 0, h - 1)
+        return detections[self._mask[cy, cx].astype(bool)]
+
+    def __call__(self, frame, **kwargs):
+        self._layout(frame)
+        if not self._crops:
+            return Detections.empty()
+
+        crops = [frame[y0:y1, x0:x1] for x0, y0, x1, y1 in self._crops]
+        self.pixels_in += sum(c.shape[0] * c.shape[1] for c in crops)
+        self.pixels_total += self._shape[0] * self._shape[1]
+
+        results = self.model(crops, conf=self.min_thresh, verbose=False, **kwargs)
+
+        parts = []
+        for (x0, y0, _, _), result in zip(self._crops, results):
+            dets = extract_detections(result.boxes, self.min_thresh)
+            dets.xyxy = dets.xyxy + np.array([x0, y0, x0, y0], dtype=np.int32)
+            parts.append(dets)
+
+        if len(parts) == 1:
+            merged = parts[0]
+        else:
+            # Region boxes can overlap, so the same object may come back from two crops
+            merged = nms(Detections(np.concatenate([p.xyxy for p in parts]),
+                                    np.concatenate([p.conf for p in parts]),
+                                    np.concatenate([p.cls for p in parts])), self.nms_iou)
+        return self._inside(merged)
+
+    @property
+    def pixel_fraction(self):
+        """Share of frame pixels that went through the model."""
+        return self.pixels_in / self.pixels_total if self.pixels_total else 0.0
@@ -0,0 +1,268 @@
+import os
+import sys
+import argparse
+import json
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import cv2
+import numpy as np
+
+from detect_backends import BACKENDS, DetectorBackend
+from detect_output import detection_record
+from detect_postprocess import extract_detections
+
+
+class MicroBatcher:
+    """Group concurrent requests into one forward pass.
+
+    A batch closes when it holds max_batch frames or when max_wait seconds
+    have passed since its first frame arrived, whichever comes first. This
+    bounds the extra queueing latency any single request can see.
+    """
+
+    def __init__(self, infer_batch, max_batch=8, max_wait=0.01):
+        self.infer_batch = infer_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='micro-batcher', daemon=True)
+
+        self.batches = 0
+        self.frames = 0
+        self.busy_time = 0.0
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=2)
+
+    def submit(self, frame):
+        """Queue a frame; the returned Future resolves to its Detections."""
+        future = Future()
+        self._queue.put((time.perf_counter(), frame, future))
+        return future
+
+    def _collect(self):
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first[0] + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+
+            t_start = time.perf_counter()
+            try:
+                results = self.infer_batch([frame for _, frame, _ in batch])
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.busy_time += time.perf_counter() - t_start
+            self.batches += 1
+            self.frames += len(batch)
+
+            for (_, _, future), detections in zip(batch, results):
+                future.set_result(detections)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'frames': self.frames,
+            'avg_batch_size': self.frames / self.batches if self.batches else 0.0,
+            'avg_batch_ms': self.busy_time / self.batches * 1000 if self.batches else 0.0,
+            'queued': self._queue.qsize(),
+        }
+
+
+class DetectionRequestHandler(BaseHTTPRequestHandler):
+    """POST /detect with an encoded image (image/jpeg, image/png) or a raw BGR frame
+    (application/octet-stream with X-Frame-Width and X-Frame-Height headers).
+    GET /health and GET /stats report the model and batching counters."""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; with Nagle on, the client's delayed ACK stalls every keep-alive response
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # TCP_NODELAY only exists for TCP connections, Unix sockets have no Nagle algorithm to turn off
+        if self.request.family not in (socket.AF_INET, socket.AF_INET6):
+            self.disable_nagle_algorithm = False
+        super().setup()
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) and self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, separators=(',', ':')).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_frame(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        content_type = self.headers.get('Content-Type', 'application/octet-stream').split(';')[0].strip()
+
+        if content_type.startswith('image/'):
+            frame = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                raise ValueError('Could not decode the image')
+            return frame
+
+        width = int(self.headers.get('X-Frame-Width', 0))
+        height = int(self.headers.get('X-Frame-Height', 0))
+        if width <= 0 or height <= 0 or len(body) != width * height * 3:
+            raise ValueError('Raw frames need X-Frame-Width and X-Frame-Height headers matching a BGR uint8 body')
+        return np.frombuffer(body, dtype=np.uint8).reshape(height, width, 3)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send_json(200, {'status': 'ok', 'backend': self.server.model.backend, 'classes': self.server.model.names})
+        elif path == '/stats':
+            self._send_json(200, self.server.batcher.stats())
+        else:
+            self._send_json(404, {'error': f'Unknown path {path}'})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path != '/detect':
+            # Read the body anyway, otherwise it would be parsed as the next request on this keep-alive connection
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self._send_json(404, {'error': f'Unknown path {path}'})
+            return
+        try:
+            frame = self._read_frame()
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        try:
+            detections = self.server.batcher.submit(frame).result(timeout=self.server.request_timeout)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+
+        self._send_json(200, detection_record(time.time(), self.server.next_frame_idx(), detections))
+
+
+class _ServiceMixin:
+    """Shared state the request handlers read from the server object."""
+
+    def setup_service(self, model, batcher, request_timeout, verbose):
+        self.model = model
+        self.batcher = batcher
+        self.request_timeout = request_timeout
+        self.verbose = verbose
+        self._frame_idx = 0
+        self._frame_lock = threading.Lock()
+
+    def next_frame_idx(self):
+        with self._frame_lock:
+            idx = self._frame_idx
+            self._frame_idx += 1
+        return idx
+
+
+class DetectionHTTPServer(_ServiceMixin, ThreadingHTTPServer):
+    daemon_threads = True
+
+
+# Windows has no AF_UNIX, and socketserver only defines UnixStreamServer where it exists
+if hasattr(socket, 'AF_UNIX'):
+    class DetectionUnixServer(_ServiceMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local detection service: loads the model once and micro-batches concurrent requests.')
+    parser.add_argument('--model', help='Path to YOLO model file (example: "my_model/my_model.pt")', required=True)
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1, local only)')
+    parser.add_argument('--port', default=8000, type=int, help='TCP port to listen on (default: 8000)')
+    parser.add_argument('--unix_socket', default=None, help='Listen on this Unix socket path instead of TCP')
+    parser.add_argument('--thresh', default=0.5, type=float, help='Minimum confidence threshold for returned detections')
+    parser.add_argument('--max_batch', default=8, type=int, help='Maximum number of frames per forward pass')
+    parser.add_argument('--max_wait_ms', default=10.0, type=float, help='Longest time a batch waits for more requests after its first one arrives')
+    parser.add_argument('--request_timeout', default=30.0, type=float, help='Seconds a request waits for its result before failing')
+    parser.add_argument('--backend', choices=BACKENDS, default='torch', help='Inference backend (see yolo_detect.py --backend)')
+    parser.add_argument('--threads', default=None, type=int, help='Number of intra-op CPU threads for the inference backend')
+    parser.add_argument('--warmup', default=2, type=int, help='Number of warm-up forward passes before accepting requests')
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+
+    args = parser.parse_args()
+
+    if args.unix_socket and not hasattr(socket, 'AF_UNIX'):
+        print('ERROR: Unix sockets are not available on this platform. Use --host and --port instead.')
+        sys.exit(0)
+
+    if not os.path.exists(args.model):
+        print('ERROR: Model path is invalid or model was not found. Make sure the model filename was entered correctly.')
+        sys.exit(0)
+
+    model = DetectorBackend(args.model, args.backend, threads=args.threads)
+    model.warmup((model.imgsz, model.imgsz, 3), runs=args.warmup, conf=args.thresh)
+
+    def infer_batch(frames):
+        results = model(frames, conf=args.thresh, verbose=False)
+        return [extract_detections(result.boxes, args.thresh) for result in results]
+
+    batcher = MicroBatcher(infer_batch, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000).start()
+
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.unlink(args.unix_socket)
+        server = DetectionUnixServer(args.unix_socket, DetectionRequestHandler)
+        where = f'unix://{args.unix_socket}'
+    else:
+        server = DetectionHTTPServer((args.host, args.port), DetectionRequestHandler)
+        where = f'http://{args.host}:{args.port}'
+    server.setup_service(model, batcher, args.request_timeout, args.verbose)
+
+    print(f'Detection service listening on {where} (max batch {args.max_batch}, max wait {args.max_wait_ms} ms)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.unlink(args.unix_socket)
+        print(f'Served {batcher.frames} frames in {batcher.batches} batches ({batcher.stats()["avg_batch_size"]:.2f} frames per batch).')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import cv2
+import numpy as np
+
+from detect_postprocess import Detections, extract_detections, nms
+
+
+def tile_offsets(length, tile, overlap):
+    """Start positions of tiles of size tile covering length, overlapping by at least overlap pixels."""
+    if length <= tile:
+        return [0]
+    stride = max(1, tile - overlap)
+    n = int(np.ceil((length - tile) / stride)) + 1
+    # Spread the tiles evenly so the last one ends exactly on the frame edge
+    return np.linspace(0, length - tile, n).round().astype(int).tolist()
+
+
+class TiledDetector:
+    """Run the model on overlapping tiles of a frame and merge the results.
+
+    Each tile matches the size the model was trained at, so small, distant
+    people keep their native pixel size instead of being shrunk with the whole
+    frame. All tiles of a frame (plus, optionally, the whole frame for people
+    too big for one tile) go through the model as one batch. Boxes cut by an
+    inner tile border are dropped, since the overlap guarantees the
+    neighbouring tile sees them whole. The rest are shifted to frame
+    coordinates and merged with a vectorized NMS.
+
+    With skip_static, tiles where less than motion_threshold of the pixels
+    changed since their last inference reuse their previous detections (at most
+    refresh_every frames in a row).
+    """
+
+    def __init__(self, model, tile_size, overlap=0.2, min_thresh=0.5, include_full_frame=True, nms_iou=0.5,
+                 edge_margin=4, skip_static=False, motion_threshold=0.01, refresh_every=30, pixel_delta=25):
+        self.model = model
+        self.tile_size = tile_size
+        self.overlap = int(tile_size * overlap)
+        self.min_thresh = min_thresh
+        self.include_full_frame = include_full_frame
+        self.nms_iou = nms_iou
+        self.edge_margin = edge_margin
+
+        self.skip_static = skip_static
+        self.motion_threshold = motion_threshold
+        self.refresh_every = refresh_every
+        self.pixel_delta = pixel_delta
+        self._motion_scale = 4
+
+        self._shape = None
+        self._tiles = None
+        self._tile_cache = None
+        self._tile_age = None
+        self._reference = None
+
+        self.tiles_run = 0
+        self.tiles_skipped = 0
+
+    def _layout(self, frame):
+        h, w = frame.shape[:2]
+        if self._shape == (h, w):
+            return
+        xs = tile_offsets(w, self.tile_size, self.overlap)
+        ys = tile_offsets(h, self.tile_size, self.overlap)
+        self._tiles = np.array([(x, y, min(x + self.tile_size, w), min(y + self.tile_size, h)) for y in ys for x in xs], dtype=np.int32)
+        self._shape = (h, w)
+        self._tile_cache = [None] * len(self._tiles)
+        self._tile_age = np.zeros(len(self._tiles), dtype=np.int32)
+        self._reference = None
+
+    def _moving_tiles(self, frame):
+        """Boolean mask of tiles whose changed-pixel fraction reaches motion_threshold."""
+        small = cv2.resize(frame, (frame.shape[1] // self._motion_scale, frame.shape[0] // self._motion_scale), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        if self._reference is None:
+            self._reference = gray
+            return np.ones(len(self._tiles), dtype=bool)
+
+        changed = (cv2.absdiff(gray, self._reference) > self.pixel_delta).astype(np.uint8)
+        integral = cv2.integral(changed)
+
+        # Changed-pixel count of every tile from the integral image, in one vectorized lookup
+        x0, y0, x1, y1 = (self._tiles // self._motion_scale).T
+        counts = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+        areas = np.maximum((x1 - x0) * (y1 - y0), 1)
+        moving = (counts / areas >= self.motion_threshold) | (self._tile_age >= self.refresh_every)
+
+        # Only move the reference forward where tiles are re-run, so slow changes still add up
+        for x0_, y0_, x1_, y1_ in (self._tiles[moving] // self._motion_scale).tolist():
+            self._reference[y0_:y1_, x0_:x1_] = gray[y0_:y1_, x0_:x1_]
+        return moving
+
+    def _drop_cut_boxes(self, detections, tile, frame_w, frame_h):
+        """Remove boxes touching a tile border that is not also a frame border."""
+        x0, y0, x1, y1 = tile
+        m = self.edge_margin
+        xyxy = detections.xyxy
+        cut = np.zeros(len(detections), dtype=bool)
+        if x0 > 0:
+            cut |= xyxy[:, 0] <= m
+        if y0 > 0:
+            cut |= xyxy[:, 1] <= m
+        if x1 < frame_w:
+            cut |= xyxy[:, 2] >= (x1 - x0) - m
+        if y1 < frame_h:
+            cut |= xyxy[:, 3] >= (y1 - y0) - m
+        return detections[~cut]
+
+    def __call__(self, frame, **kwargs):
+        self._layout(frame)
+        h, w = frame.shape[:2]
+
+        if self.skip_static:
+            run = self._moving_tiles(frame)
+        else:
+            run = np.ones(len(self._tiles), dtype=bool)
+        # Tiles without cached results always run
+        run |= np.array([cache is None for cache in self._tile_cache])
+
+        crops = [frame[y0:y1, x0:x1] for (x0, y0, x1, y1), r in zip(self._tiles.tolist(), run) if r]
+        if self.include_full_frame:
+            crops.append(frame)
+
+        results = self.model(crops, conf=self.min_thresh, imgsz=self.tile_size, verbose=False, **kwargs) if crops else []
+        results = iter(results)
+
+        parts = []
+        for i, tile in enumerate(self._tiles.tolist()):
+            if run[i]:
+                tile_dets = self._drop_cut_boxes(extract_detections(next(results).boxes, self.min_thresh), tile, w, h)
+                tile_dets.xyxy = tile_dets.xyxy + np.array([tile[0], tile[1], tile[0], tile[1]], dtype=np.int32)
+                self._tile_cache[i] = tile_dets
+                self._tile_age[i] = 0
+                self.tiles_run += 1
+            else:
+                self._tile_age[i] += 1
+                self.tiles_skipped += 1
+            parts.append(self._tile_cache[i])
+        if self.include_full_frame:
+            parts.append(extract_detections(next(results).boxes, self.min_thresh))
+
+        merged = Detections(np.concatenate([p.xyxy for p in parts]),
+                            np.concatenate([p.conf for p in parts]),
+                            np.concatenate([p.cls for p in parts]))
+        return nms(merged, self.nms_iou)
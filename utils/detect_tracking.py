@@ -0,0 +1,180 @@
+import warnings
+
+import cv2
+import numpy as np
+
+from detect_postprocess import Detections, iou_matrix
+
+
+def greedy_match(iou, min_iou):
+    """Match rows to columns by descending IoU. Returns a list of (row, col) pairs."""
+    pairs = []
+    if iou.size == 0:
+        return pairs
+    rows, cols = np.nonzero(iou >= min_iou)
+    order = np.argsort(-iou[rows, cols])
+    used_rows = set()
+    used_cols = set()
+    for r, c in zip(rows[order].tolist(), cols[order].tolist()):
+        if r in used_rows or c in used_cols:
+            continue
+        used_rows.add(r)
+        used_cols.add(c)
+        pairs.append((r, c))
+    return pairs
+
+
+class IouTracker:
+    """Keep stable IDs for detections across frames.
+
+    On detection frames, tracks are matched to new boxes by IoU. Between
+    detection frames, every box is moved by the median optical flow of a small
+    grid of points inside it (one pyramidal Lucas-Kanade call for all boxes),
+    so the model only has to run every few frames. Tracks that go unmatched
+    for max_missed detection rounds are dropped.
+    """
+
+    def __init__(self, min_iou=0.3, max_missed=2, grid=4):
+        self.min_iou = min_iou
+        self.max_missed = max_missed
+        self.grid = grid
+
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.conf = np.zeros(0, dtype=np.float32)
+        self.cls = np.zeros(0, dtype=np.int32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.missed = np.zeros(0, dtype=np.int32)
+        self._next_id = 1
+        self._prev_gray = None
+
+        # Inner grid of sample points in box-relative coordinates (avoid the box borders, which are mostly background)
+        steps = np.linspace(0.25, 0.75, grid, dtype=np.float32)
+        gx, gy = np.meshgrid(steps, steps)
+        self._grid = np.stack([gx.ravel(), gy.ravel()], axis=1)
+
+    def _propagate(self, gray):
+        if self._prev_gray is None or len(self.boxes) == 0 or self._prev_gray.shape != gray.shape:
+            return
+
+        sizes = self.boxes[:, 2:] - self.boxes[:, :2]
+        points = self.boxes[:, None, :2] + self._grid[None, :, :] * sizes[:, None, :]
+        points = points.reshape(-1, 1, 2).astype(np.float32)
+
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, points, None, winSize=(15, 15), maxLevel=2)
+        flow = (new_points - points).reshape(len(self.boxes), -1, 2)
+        valid = status.reshape(len(self.boxes), -1).astype(bool)
+
+        # Median flow of the points that were tracked; boxes with no valid points stay in place
+        flow[~valid] = np.nan
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # all-NaN rows are expected for lost boxes
+            shift = np.nanmedian(flow, axis=1)
+        shift = np.nan_to_num(shift)
+        self.boxes += np.tile(shift, 2)
+
+    def _associate(self, detections):
+        det_boxes = detections.xyxy.astype(np.float32)
+        pairs = greedy_match(iou_matrix(self.boxes, det_boxes), self.min_iou)
+
+        matched_tracks = np.array([t for t, _ in pairs], dtype=np.int64)
+        matched_dets = np.array([d for _, d in pairs], dtype=np.int64)
+
+        # Matched tracks take the fresh box; unmatched ones age out
+        self.missed += 1
+        if len(pairs):
+            self.boxes[matched_tracks] = det_boxes[matched_dets]
+            self.conf[matched_tracks] = detections.conf[matched_dets]
+            self.cls[matched_tracks] = detections.cls[matched_dets]
+            self.missed[matched_tracks] = 0
+
+        keep = self.missed <= self.max_missed
+        self.boxes, self.conf, self.cls = self.boxes[keep], self.conf[keep], self.cls[keep]
+        self.ids, self.missed = self.ids[keep], self.missed[keep]
+
+        # Unmatched detections start new tracks
+        new = np.ones(len(detections), dtype=bool)
+        new[matched_dets] = False
+        n_new = int(new.sum())
+        if n_new:
+            self.boxes = np.concatenate([self.boxes, det_boxes[new]])
+            self.conf = np.concatenate([self.conf, detections.conf[new]])
+            self.cls = np.concatenate([self.cls, detections.cls[new]])
+            self.ids = np.concatenate([self.ids, np.arange(self._next_id, self._next_id + n_new)])
+            self.missed = np.concatenate([self.missed, np.zeros(n_new, dtype=np.int32)])
+            self._next_id += n_new
+
+    @property
+    def tracks_started(self):
+        return self._next_id - 1
+
+    def update(self, gray, detections=None):
+        """Advance tracks to this frame and return them as Detections with track_ids.
+
+        gray is the grayscale frame. detections are the model results when the
+        detector ran on this frame, or None on frames between detections.
+        """
+        self._propagate(gray)
+        if detections is not None:
+            self._associate(detections)
+        self._prev_gray = gray
+
+        # Only report tracks that were seen on the last detection round
+        visible = self.missed == 0
+        return Detections(self.boxes[visible].astype(np.int32), self.conf[visible], self.cls[visible], self.ids[visible])
+
+
+class LineCounter:
+    """Count tracks crossing a line segment, in both directions.
+
+    A track's side of the line is the sign of the cross product between the
+    line direction and its box center. The side only changes once the center
+    is more than margin pixels away from the line, so jitter on the line is
+    not counted. Moving onto the left side of the line, as seen on screen when
+    looking from (x1,y1) towards (x2,y2), counts as "in"; the opposite as "out".
+    """
+
+    def __init__(self, x1, y1, x2, y2, margin=5):
+        self.p1 = np.array([x1, y1], dtype=np.float32)
+        self.p2 = np.array([x2, y2], dtype=np.float32)
+        direction = self.p2 - self.p1
+        self._length = float(np.hypot(*direction))
+        if self._length == 0:
+            raise ValueError('Counting line needs two different points')
+        self._direction = direction / self._length
+        self.margin = margin
+        self.count_in = 0
+        self.count_out = 0
+        self._sides = {}
+
+    def update(self, detections):
+        """Update counts with the tracked detections of one frame."""
+        if detections.track_ids is None or len(detections) == 0:
+            return
+
+        centers = (detections.xyxy[:, :2] + detections.xyxy[:, 2:]) / 2.0
+        rel = centers - self.p1
+        distance = rel[:, 0] * self._direction[1] - rel[:, 1] * self._direction[0]  # signed distance to the line
+        along = rel @ self._direction  # position along the segment
+
+        inside = (along >= 0) & (along <= self._length) & (np.abs(distance) > self.margin)
+        sides = np.sign(distance).astype(np.int8)
+
+        for track_id, side, ok in zip(detections.track_ids.tolist(), sides.tolist(), inside.tolist()):
+            if not ok:
+                continue
+            previous = self._sides.get(track_id)
+            if previous is not None and previous != side:
+                if side > 0:
+                    self.count_in += 1
+                else:
+                    self.count_out += 1
+            self._sides[track_id] = side
+
+    def forget(self, active_ids):
+        """Drop sides of tracks that no longer exist."""
+        active = set(active_ids)
+        self._sides = {k: v for k, v in self._sides.items() if k in active}
+
+    def draw(self, frame):
+        cv2.line(frame, tuple(self.p1.astype(int)), tuple(self.p2.astype(int)), (0,0,255), 2)
+        cv2.putText(frame, f'In: {self.count_in}  Out: {self.count_out}', (10,60), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2)
@@ -0,0 +1,90 @@
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+
+# Enhancement applied to the training images by data_preprocess. The detector uses the same
+# settings with --enhance, so the model sees the same kind of pixels it was trained on.
+TRAINING_ENHANCEMENT = {"white_balance": True, "clahe_clip": 2.0, "clahe_grid": (8, 8), "gamma": 1.0}
+
+
+@lru_cache(maxsize=32)
+def gamma_table(gamma):
+    """256-entry uint8 lookup table for a gamma correction."""
+    inv_gamma = 1.0 / gamma
+    return ((np.arange(256) / 255.0) ** inv_gamma * 255).astype(np.uint8)
+
+
+class EnhancementPipeline:
+    """White balance, CLAHE and gamma in one pass over the image.
+
+    White balance (shifting the mean of the A and B channels to neutral) and
+    CLAHE (on L) both work in LAB, so they share a single BGR->LAB->BGR round
+    trip instead of one each. The white balance shift is a per-channel lookup
+    table, the CLAHE object and the gamma table are built once, and steps
+    that would not change the image (gamma 1.0, no CLAHE, no white balance)
+    are skipped entirely. Intermediate LAB and L buffers are reused between
+    calls while the image size stays the same.
+
+    The result is written back into the input image, which is also returned.
+    The buffers make an instance unsafe to share between threads; use one
+    per thread or process.
+    """
+
+    def __init__(self, white_balance=True, clahe_clip=2.0, clahe_grid=(8, 8), gamma=1.0):
+        self.white_balance = white_balance
+        self.clahe_clip = clahe_clip
+        self.clahe_grid = tuple(clahe_grid)
+        self.gamma = gamma
+
+        self._clahe = cv2.createCLAHE(clipLimit=clahe_clip, tileGridSize=self.clahe_grid) if clahe_clip else None
+        self._gamma_table = gamma_table(gamma) if gamma != 1.0 else None
+        self._lab_lut = np.empty((256, 1, 3), dtype=np.uint8)
+        self._lab_lut[:, 0, 0] = np.arange(256, dtype=np.uint8)
+        self._levels = np.arange(256, dtype=np.float32)
+        self._shifted = np.empty(256, dtype=np.float32)
+        self._lab = None
+        self._l = None
+
+    @classmethod
+    def training(cls):
+        return cls(**TRAINING_ENHANCEMENT)
+
+    @property
+    def is_identity(self):
+        return not self.white_balance and self._clahe is None and self._gamma_table is None
+
+    def _buffers(self, img):
+        if self._lab is None or self._lab.shape != img.shape:
+            self._lab = np.empty_like(img)
+            self._l = np.empty(img.shape[:2], dtype=np.uint8)
+
+    def __call__(self, img):
+        if self.white_balance or self._clahe is not None:
+            self._buffers(img)
+            lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB, dst=self._lab)
+
+            if self.white_balance:
+                # Moving the A and B means to 128 is a constant shift per channel, so it fits in the lookup table
+                _, mean_a, mean_b, _ = cv2.mean(lab)
+                for channel, mean in ((1, mean_a), (2, mean_b)):
+                    np.add(self._levels, np.float32(128 - mean), out=self._shifted)
+                    np.clip(self._shifted, 0, 255, out=self._shifted)
+                    self._lab_lut[:, 0, channel] = self._shifted
+                cv2.LUT(lab, self._lab_lut, dst=lab)
+
+            if self._clahe is not None:
+                cv2.extractChannel(lab, 0, dst=self._l)
+                self._clahe.apply(self._l, dst=self._l)
+                cv2.insertChannel(self._l, lab, 0)
+
+            cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=img)
+
+        if self._gamma_table is not None:
+            cv2.LUT(img, self._gamma_table, dst=img)
+        return img
+
+    def params(self):
+        return {"white_balance": self.white_balance, "clahe_clip": self.clahe_clip,
+                "clahe_grid": list(self.clahe_grid), "gamma": self.gamma}
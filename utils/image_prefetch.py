@@ -0,0 +1,90 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+
+img_ext_list = ['.jpg','.JPG','.jpeg','.JPEG','.png','.PNG','.bmp','.BMP']
+
+# cv2.imread flags that let libjpeg decode straight to 1/2, 1/4 or 1/8 of the size
+REDUCED_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+
+def list_images(folder, recursive=False):
+    """Sorted image paths in folder (and its subfolders when recursive)."""
+    paths = []
+    if recursive:
+        for root, _, files in os.walk(folder):
+            for name in files:
+                if os.path.splitext(name)[1] in img_ext_list:
+                    paths.append(os.path.join(root, name))
+    else:
+        for entry in os.scandir(folder):
+            if entry.is_file() and os.path.splitext(entry.name)[1] in img_ext_list:
+                paths.append(entry.path)
+    return sorted(paths)
+
+
+def reduce_flag(src_w, src_h, target_w, target_h):
+    """Largest reduced-decode flag that still leaves the image at least target_w x target_h."""
+    for factor, flag in REDUCED_FLAGS:
+        if src_w // factor >= target_w and src_h // factor >= target_h:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+class PrefetchImageLoader:
+    """Read and decode images ahead of the consumer on a thread pool.
+
+    cv2.imread releases the GIL, so several workers decode in parallel while
+    the model runs. At most prefetch images are in flight, and they are
+    yielded in path order. When target_size (w, h) is much smaller than the
+    source, JPEGs are decoded directly at a reduced scale; the scale is picked
+    from the first image and checked on every image, falling back to a full
+    decode if a reduced one comes out too small.
+    """
+
+    def __init__(self, paths, workers=4, prefetch=16, target_size=None):
+        self.paths = list(paths)
+        self.workers = workers
+        self.prefetch = max(prefetch, workers)
+        self.target_size = target_size
+        self._flag = cv2.IMREAD_COLOR
+        self.reduced_decodes = 0
+
+    def _read(self, path):
+        if self._flag != cv2.IMREAD_COLOR:
+            frame = cv2.imread(path, self._flag)
+            if frame is not None and frame.shape[1] >= self.target_size[0] and frame.shape[0] >= self.target_size[1]:
+                self.reduced_decodes += 1
+                return frame
+        return cv2.imread(path)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        """Yield (path, frame) pairs in order; frame is None for files that could not be decoded."""
+        if not self.paths:
+            return
+
+        # Decode the first image at full size to pick the reduced-decode scale for the rest
+        first = cv2.imread(self.paths[0])
+        if first is not None and self.target_size:
+            self._flag = reduce_flag(first.shape[1], first.shape[0], *self.target_size)
+        yield self.paths[0], first
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            remaining = iter(self.paths[1:])
+            for path in remaining:
+                pending.append((path, pool.submit(self._read, path)))
+                if len(pending) >= self.prefetch:
+                    break
+            while pending:
+                path, future = pending.popleft()
+                next_path = next(remaining, None)
+                if next_path is not None:
+                    pending.append((next_path, pool.submit(self._read, next_path)))
+                yield path, future.result()
@@ -0,0 +1,196 @@
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+KEEP_POLICIES = ("first", "largest", "most_labels")
+CROSS_SPLIT_POLICIES = ("report", "train")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def dhash(img_path, hash_size=8):
+    """Hash perceptual por diferencias (dHash) de hash_size² bits y número de píxeles de la imagen.
+
+    Devuelve (hash, píxeles) o (None, 0) si la imagen no se puede leer.
+    """
+    try:
+        with Image.open(img_path) as img:
+            pixels = img.size[0] * img.size[1]
+            # draft deja que el decodificador JPEG reduzca la imagen al leerla, así casi no hay que decodificar
+            img.draft("L", (hash_size * 8, hash_size * 8))
+            small = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+            values = list(small.getdata())
+    except Exception:
+        return None, 0
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (values[offset + col] > values[offset + col + 1])
+    return bits, pixels
+
+
+def compute_hashes(paths, workers=None, chunksize=32):
+    """dhash de cada ruta, calculado en un pool de procesos. Devuelve una lista en el mismo orden."""
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(dhash, paths, chunksize=chunksize))
+
+
+class BKTree:
+    """Árbol BK sobre distancia de Hamming: búsqueda de todos los hashes a distancia <= radius sin comparar con todos.
+
+    Cada nodo guarda un hash, los elementos con ese hash exacto y sus hijos
+    indexados por distancia. Por la desigualdad triangular, una búsqueda solo
+    baja a los hijos con distancia en [d - radius, d + radius].
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, h, item):
+        self.size += 1
+        if self.root is None:
+            self.root = (h, [item], {})
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = (h, [item], {})
+                return
+            node = child
+
+    def query(self, h, radius):
+        """Lista de (distancia, elemento) con distancia <= radius."""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node_hash, items, children = stack.pop()
+            d = hamming(h, node_hash)
+            if d <= radius:
+                found.extend((d, item) for item in items)
+            for child_d, child in children.items():
+                if d - radius <= child_d <= d + radius:
+                    stack.append(child)
+        return found
+
+
+def cluster_hashes(hashes, radius=4, order=None):
+    """Agrupa los índices de hashes alrededor de líderes, sin encadenar vecinos.
+
+    Se recorren los índices en order (por defecto, el de la lista): cada uno
+    aún sin asignar se convierte en líder y se queda con todos los no
+    asignados a distancia <= radius de él. Así cada miembro está a <= radius
+    de su líder, aunque haya secuencias largas de hashes que cambian poco a
+    poco. Devuelve [(líder, [miembros])] solo de los clusters con miembros.
+    """
+    tree = BKTree()
+    for i, h in enumerate(hashes):
+        if h is not None:
+            tree.add(h, i)
+
+    assigned = set()
+    clusters = []
+    for i in (range(len(hashes)) if order is None else order):
+        if hashes[i] is None or i in assigned:
+            continue
+        assigned.add(i)
+        members = sorted(j for _, j in tree.query(hashes[i], radius) if j not in assigned)
+        assigned.update(members)
+        if members:
+            clusters.append((i, members))
+    return clusters
+
+
+def _label_count(label_path):
+    if label_path is None:
+        return 0
+    try:
+        with open(label_path, "rb") as f:
+            return sum(1 for line in f if line.strip())
+    except OSError:
+        return 0
+
+
+def plan_near_duplicates(images, radius=4, keep="first", cross_split="report", workers=None):
+    """Busca imágenes casi idénticas y decide cuáles quitar.
+
+    images es una lista de (ruta, split, etiqueta). Cada split se agrupa
+    con cluster_hashes tomando como líderes, por orden de preferencia según
+    keep: "first" (orden alfabético), "largest" (más píxeles) o
+    "most_labels" (más cajas). Se conserva el líder y se quitan sus
+    miembros, así toda imagen quitada está a <= radius de una conservada.
+    Las conservadas que están a <= radius de una conservada de otro split
+    (train primero) son fugas; con cross_split="train" las imágenes de otros
+    splits cercanas a una de train se quitan, con "report" solo se informan.
+    Devuelve (entradas al estilo de validate_dataset, fugas).
+    """
+    if keep not in KEEP_POLICIES:
+        raise ValueError(f"Política {keep} no válida, opciones: {', '.join(KEEP_POLICIES)}")
+    if cross_split not in CROSS_SPLIT_POLICIES:
+        raise ValueError(f"Política {cross_split} no válida, opciones: {', '.join(CROSS_SPLIT_POLICIES)}")
+
+    images = sorted(images)
+    results = compute_hashes([path for path, _, _ in images], workers=workers)
+    hashes = [h for h, _ in results]
+    if keep == "largest":
+        rank = {i: (-results[i][1], i) for i in range(len(images))}
+    elif keep == "most_labels":
+        rank = {i: (-_label_count(images[i][2]), i) for i in range(len(images))}
+    else:
+        rank = {i: i for i in range(len(images))}
+
+    by_split = {}
+    for i, (_, split, _) in enumerate(images):
+        if hashes[i] is not None:
+            by_split.setdefault(split, []).append(i)
+
+    entries = []
+    leakage = []
+    # Imágenes conservadas de los splits ya procesados (train primero), para buscar fugas entre splits
+    kept_tree = BKTree()
+    for split in sorted(by_split, key=lambda s: (s != "train", s)):
+        idx = by_split[split]
+        if cross_split == "train" and split != "train":
+            rest = []
+            for i in idx:
+                found = [(d, j) for d, (s, j) in kept_tree.query(hashes[i], radius) if s == "train"]
+                if found:
+                    d, j = min(found)
+                    leakage.append({"train": images[j][0], split: images[i][0]})
+                    entries.append({"image": images[i][0], "label": images[i][2], "split": split,
+                                    "issues": {"near_duplicate": f"distancia {d} a {images[j][0]} (train)"}})
+                else:
+                    rest.append(i)
+            idx = rest
+
+        local = [hashes[i] for i in idx]
+        order = sorted(range(len(idx)), key=lambda k: rank[idx[k]])
+        removed = set()
+        for leader, members in cluster_hashes(local, radius, order):
+            best = idx[leader]
+            for k in members:
+                i = idx[k]
+                removed.add(i)
+                entries.append({"image": images[i][0], "label": images[i][2], "split": split,
+                                "issues": {"near_duplicate": f"distancia {hamming(hashes[i], hashes[best])} a {images[best][0]}"}})
+
+        kept = [i for i in idx if i not in removed]
+        for i in kept:
+            found = kept_tree.query(hashes[i], radius)
+            if found:
+                _, (other_split, j) = min(found)
+                leakage.append({other_split: images[j][0], split: images[i][0]})
+        for i in kept:
+            kept_tree.add(hashes[i], (split, i))
+    return entries, leakage
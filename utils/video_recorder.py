@@ -0,0 +1,141 @@
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+
+class AsyncVideoRecorder:
+    """Encode frames on a background thread behind a bounded queue.
+
+    For live sources write() never waits for the encoder: if the queue is
+    full the frame is dropped and counted, and the frame rate written to the
+    file is measured from the first few frames' arrival times (unless fps is
+    given), so playback speed matches what was captured. With lossless=True
+    (video files) write() waits for room instead, so every frame is kept;
+    pass the file's own frame rate as fps. Output rotates to a new numbered file
+    ("demo1_001.avi", ...) once it reaches rotate_mb megabytes or
+    rotate_seconds seconds.
+    """
+
+    def __init__(self, path, frame_size, codec='MJPG', fps=None, queue_size=64,
+                 rotate_mb=None, rotate_seconds=None, measure_frames=30, lossless=False):
+        self.path = path
+        self.frame_size = frame_size
+        self.codec = codec
+        self.rotate_bytes = rotate_mb * 1024 * 1024 if rotate_mb else None
+        self.rotate_seconds = rotate_seconds
+        self.measure_frames = measure_frames
+        self.lossless = lossless
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._part = 0
+        self._part_path = None
+        self._part_started = None
+        self._pending = []  # frames held back while the frame rate is measured
+        self._closed = False
+
+        self.fps = fps
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.max_queued = 0
+        self.files = []
+
+        self._thread = threading.Thread(target=self._encode_loop, name='recorder', daemon=True)
+        self._thread.start()
+
+    def write(self, frame):
+        """Queue a frame for encoding; without blocking unless the recorder is lossless."""
+        try:
+            self._queue.put((time.perf_counter(), frame), block=self.lossless)
+        except queue.Full:
+            self.frames_dropped += 1
+            return
+        queued = self._queue.qsize()
+        if queued > self.max_queued:
+            self.max_queued = queued
+
+    @property
+    def queued(self):
+        return self._queue.qsize()
+
+    def _next_path(self):
+        if self.rotate_bytes is None and self.rotate_seconds is None:
+            return self.path
+        stem, ext = os.path.splitext(self.path)
+        self._part += 1
+        return f'{stem}_{self._part:03d}{ext}'
+
+    def _open(self):
+        self._part_path = self._next_path()
+        self._writer = cv2.VideoWriter(self._part_path, cv2.VideoWriter_fourcc(*self.codec), self.fps, self.frame_size)
+        if not self._writer.isOpened():
+            print(f'WARNING: could not open {self._part_path} with codec {self.codec}; frames will not be recorded.')
+        self._part_started = time.perf_counter()
+        self.files.append(self._part_path)
+
+    def _should_rotate(self):
+        if self.rotate_seconds is not None and time.perf_counter() - self._part_started >= self.rotate_seconds:
+            return True
+        # Checking the size on disk is a syscall, so only do it every 30 frames
+        if self.rotate_bytes is not None and self.frames_written % 30 == 0:
+            return os.path.exists(self._part_path) and os.path.getsize(self._part_path) >= self.rotate_bytes
+        return False
+
+    def _encode(self, frame):
+        if self._writer is not None and self._should_rotate():
+            self._writer.release()
+            self._writer = None
+        if self._writer is None:
+            self._open()
+        if frame.shape[1::-1] != tuple(self.frame_size):
+            frame = cv2.resize(frame, tuple(self.frame_size))
+        self._writer.write(frame)
+        self.frames_written += 1
+
+    def _flush_pending(self):
+        """Fix the frame rate from the held-back frames and encode them."""
+        if self.fps is None:
+            if len(self._pending) >= 2:
+                span = self._pending[-1][0] - self._pending[0][0]
+                self.fps = (len(self._pending) - 1) / span if span > 0 else 30.0
+            else:
+                self.fps = 30.0
+        for _, frame in self._pending:
+            self._encode(frame)
+        self._pending = []
+
+    def _encode_loop(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._closed:
+                    break
+                continue
+            if item is None:
+                break
+
+            if self.fps is None:
+                self._pending.append(item)
+                if len(self._pending) >= self.measure_frames:
+                    self._flush_pending()
+            else:
+                self._encode(item[1])
+
+        if self._pending:
+            self._flush_pending()
+        if self._writer is not None:
+            self._writer.release()
+
+    def release(self):
+        """Encode everything still queued and close the file."""
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def summary(self):
+        return (f'Recorded {self.frames_written} frames at {self.fps or 0:.2f} FPS to {", ".join(self.files) or "(nothing)"}; '
+                f'{self.frames_dropped} frames dropped, at most {self.max_queued} queued.')
@@ -1,12 +1,24 @@
 import os
 import sys
 import argparse
-import glob
+import signal
 import time
 
 import cv2
-import numpy as np
-from ultralytics import YOLO
+
+from detect_adaptive import AdaptiveResolution
+from detect_backends import DetectorBackend, print_backend_comparison, record_backend_stats
+from detect_metrics import Profiler, RollingWindow
+from detect_motion import MotionGate
+from detect_pipeline import DetectionPipeline
+from detect_postprocess import Annotator, extract_detections
+from detect_roi import ROI_MODES, RoiDetector, load_roi_config
+from detect_tiling import TiledDetector
+from detect_tracking import IouTracker, LineCounter
+from image_enhance import EnhancementPipeline
+from image_prefetch import PrefetchImageLoader, list_images
+from detect_output import open_detection_writer
+from video_recorder import AsyncVideoRecorder
 
 # Define and parse user input arguments
 
@@ -21,8 +33,90 @@ parser.add_argument('--thresh', help='Minimum confidence threshold for displayin
 parser.add_argument('--resolution', help='Resolution in WxH to display inference results at (example: "640x480"), \
                     otherwise, match source resolution',
                     default=None)
-parser.add_argument('--record', help='Record results from video or webcam and save it as "demo1.avi". Must specify --resolution argument to record.',
+parser.add_argument('--record', help='Record results from video or webcam and save it as --record_path. Must specify --resolution argument to record.',
+                    action='store_true')
+parser.add_argument('--record_path', help='Output file for --record; the extension picks the container (default: "demo1.avi")',
+                    default='demo1.avi')
+parser.add_argument('--record_codec', help='FourCC code of the codec used by --record (example: "MJPG", "mp4v", "XVID", default: "MJPG")',
+                    default='MJPG')
+parser.add_argument('--record_fps', help='Frame rate stamped into the recording (default: the frame rate of video files, measured from the first frames for cameras)',
+                    default=None)
+parser.add_argument('--record_queue', help='Number of frames that can wait for the background encoder before new camera frames are dropped (default: 64)',
+                    default=64)
+parser.add_argument('--record_rotate_mb', help='Start a new numbered recording file once the current one reaches this many megabytes',
+                    default=None)
+parser.add_argument('--record_rotate_s', help='Start a new numbered recording file after this many seconds',
+                    default=None)
+parser.add_argument('--pipeline', help='Run capture, inference and display/record as separate threaded stages. \
+                    Only for video, USB camera and Picamera sources; live cameras always process the newest frame.',
+                    action='store_true')
+parser.add_argument('--batch', help='Non-interactive batched mode for image folder and video sources: run N frames per forward pass (example: "8"). \
+                    Annotated images are saved to --save_dir, annotated video frames are recorded if --record is set.',
+                    default=None)
+parser.add_argument('--save_dir', help='Folder where annotated images are written in --batch mode (default: "batch_results")',
+                    default='batch_results')
+parser.add_argument('--headless', help='Skip all drawing and GUI calls and stream per-frame detections to --output instead (for machines without a display)',
+                    action='store_true')
+parser.add_argument('--output', help='Detection record file written in --headless mode (default: "detections.jsonl")',
+                    default='detections.jsonl')
+parser.add_argument('--output_format', help='Format of the --output file: "jsonl" (one JSON object per frame) or "bin" (compact binary records). \
+                    Defaults to the file extension.',
+                    choices=['jsonl', 'bin'], default=None)
+parser.add_argument('--backend', help='Inference backend: "torch" runs the .pt weights, "onnx" and "openvino" export them once next to the weights and run the export on CPU',
+                    choices=['torch', 'onnx', 'openvino'], default='torch')
+parser.add_argument('--threads', help='Number of intra-op CPU threads for the inference backend (example: "4")',
+                    default=None)
+parser.add_argument('--interop_threads', help='Number of inter-op threads (torch, onnx) or inference streams (openvino) for the backend',
+                    default=None)
+parser.add_argument('--backend_stats', help='JSON file where this run\'s backend latency is stored, to compare backends across runs on this host (example: "backend_stats.json"). \
+                    Not written by default.',
+                    default=None)
+parser.add_argument('--motion_gate', help='Skip inference on static frames and reuse the last detections. Value is the fraction of changed pixels \
+                    (on a small downscaled frame) needed to run the model (example: "0.01")',
+                    default=None)
+parser.add_argument('--motion_method', help='How motion is scored for --motion_gate: "diff" against the last inferred frame or "mog2" background subtraction',
+                    choices=['diff', 'mog2'], default='diff')
+parser.add_argument('--refresh_every', help='With --motion_gate, always run the model after this many skipped frames in a row (default: 30)',
+                    default=30)
+parser.add_argument('--track', help='Track objects with stable IDs, running the detector only every --detect_every frames and following boxes with optical flow in between',
+                    action='store_true')
+parser.add_argument('--detect_every', help='With --track, run the detector once every N frames (default: 5)',
+                    default=5)
+parser.add_argument('--count_line', help='With --track, count objects crossing the line "x1,y1,x2,y2" (in display pixels, example: "0,360,1280,360")',
+                    default=None)
+parser.add_argument('--tile', help='Sliced inference for small, distant objects: run the model on overlapping tiles of each frame (one batch per frame) and merge the boxes',
+                    action='store_true')
+parser.add_argument('--tile_size', help='With --tile, tile size in pixels (default: the image size the model was trained at)',
+                    default=None)
+parser.add_argument('--tile_overlap', help='With --tile, overlap between neighbouring tiles as a fraction of the tile size (default: 0.2)',
+                    default=0.2)
+parser.add_argument('--tile_skip_static', help='With --tile, reuse the previous detections of tiles where nothing moved',
+                    action='store_true')
+parser.add_argument('--enhance', help='Apply the same white balance, CLAHE and gamma enhancement that data_preprocess applies to the training images to every frame',
                     action='store_true')
+parser.add_argument('--roi_config', help='JSON file with regions of interest (rectangles or polygons in display pixels) per source; \
+                    only those regions go through the model and detections centered outside them are dropped',
+                    default=None)
+parser.add_argument('--roi_mode', help='With --roi_config, "crop" runs the model on the bounding box of all regions, "batch" runs one crop per region in a single batch',
+                    choices=list(ROI_MODES), default='crop')
+parser.add_argument('--profile', help='Print per-stage latency (capture, resize, inference, post-processing, drawing, display, recording) at exit',
+                    action='store_true')
+parser.add_argument('--metrics_out', help='Periodically export per-stage latency (mean, p50/p95/p99) to this file (example: "metrics.csv" or "metrics.prom")',
+                    default=None)
+parser.add_argument('--metrics_format', help='Format of --metrics_out: "csv" (rows appended) or "prom" (Prometheus text format, rewritten). Defaults to the file extension.',
+                    choices=['csv', 'prom'], default=None)
+parser.add_argument('--metrics_interval', help='Seconds between --metrics_out exports (default: 5)',
+                    default=5)
+parser.add_argument('--recursive', help='For image folder sources, also read images in subfolders',
+                    action='store_true')
+parser.add_argument('--prefetch_workers', help='Number of threads reading and decoding images ahead of inference for image folder sources (default: 4)',
+                    default=4)
+parser.add_argument('--adaptive_latency_ms', help='Hold this per-frame latency (in ms) by stepping the model input size and display resolution down or up as the host gets busier or quieter (example: "80")',
+                    default=None)
+parser.add_argument('--adaptive_sizes', help='With --adaptive_latency_ms, comma-separated model input sizes to choose from (default: "320,416,512,640")',
+                    default='320,416,512,640')
+parser.add_argument('--warmup', help='Number of warm-up forward passes to run before the loop starts (default: 2)',
+                    default=2)
 
 args = parser.parse_args()
 
@@ -30,17 +124,23 @@ args = parser.parse_args()
 # Parse user inputs
 model_path = args.model
 img_source = args.source
-min_thresh = args.thresh
+min_thresh = float(args.thresh)
 user_res = args.resolution
 record = args.record
+pipelined = args.pipeline
+batch_size = int(args.batch) if args.batch else 0
+save_dir = args.save_dir
+headless = args.headless
 
 # Check if model file exists and is valid
 if (not os.path.exists(model_path)):
     print('ERROR: Model path is invalid or model was not found. Make sure the model filename was entered correctly.')
     sys.exit(0)
 
-# Load the model into memory and get labemap
-model = YOLO(model_path, task='detect')
+# Load the model into memory on the chosen backend (exporting it on first use) and get labemap
+model = DetectorBackend(model_path, args.backend,
+                        threads=int(args.threads) if args.threads else None,
+                        interop_threads=int(args.interop_threads) if args.interop_threads else None)
 labels = model.names
 
 # Parse input to determine if image source is a file, folder, video, or USB camera
@@ -68,6 +168,52 @@ else:
     print(f'Input {img_source} is invalid. Please try again.')
     sys.exit(0)
 
+# Check if pipelined mode is valid for this source
+if pipelined and source_type not in ['video','usb','picamera']:
+    print('Pipelined mode only works for video, USB camera and Picamera sources. Please try again.')
+    sys.exit(0)
+
+# Check if batched mode is valid for this source
+if batch_size:
+    if source_type not in ['image','folder','video']:
+        print('Batched mode only works for image, image folder and video sources. Please try again.')
+        sys.exit(0)
+    if pipelined:
+        print('Batched mode and pipelined mode cannot be combined. Please choose one.')
+        sys.exit(0)
+    if batch_size < 1:
+        print('Invalid entry for batch. Please enter a positive integer.')
+        sys.exit(0)
+
+# Check if tracking mode is valid
+if args.track:
+    if batch_size:
+        print('Tracking needs frames in order one at a time, so it cannot be combined with batched mode. Please choose one.')
+        sys.exit(0)
+    if args.motion_gate:
+        print('Tracking already skips inference between detection frames, so it cannot be combined with motion gating. Please choose one.')
+        sys.exit(0)
+if args.count_line and not args.track:
+    print('Line-crossing counts need --track. Please try again.')
+    sys.exit(0)
+
+# Check if adaptive resolution is valid
+if args.adaptive_latency_ms:
+    if source_type not in ['video','usb','picamera']:
+        print('Adaptive resolution only works for video, USB camera and Picamera sources. Please try again.')
+        sys.exit(0)
+    if batch_size:
+        print('Adaptive resolution adjusts per frame, so it cannot be combined with batched mode. Please choose one.')
+        sys.exit(0)
+    if args.tile:
+        print('Tiled inference uses a fixed tile size, so it cannot be combined with adaptive resolution. Please choose one.')
+        sys.exit(0)
+
+# Check if headless mode is valid
+if headless and record:
+    print('Recording needs the drawn frames, so it cannot be combined with headless mode. Please choose one.')
+    sys.exit(0)
+
 # Parse user-specified display resolution
 resize = False
 if user_res:
@@ -83,166 +229,498 @@ if record:
         print('Please specify resolution to record video at.')
         sys.exit(0)
     
-    # Set up recording
-    record_name = 'demo1.avi'
-    record_fps = 30
-    recorder = cv2.VideoWriter(record_name, cv2.VideoWriter_fourcc(*'MJPG'), record_fps, (resW,resH))
+    if len(args.record_codec) != 4:
+        print(f'Codec {args.record_codec} is not a four character code. Please try again.')
+        sys.exit(0)
 
 # Load or initialize image source
-if source_type == 'image':
-    imgs_list = [img_source]
-elif source_type == 'folder':
-    imgs_list = []
-    filelist = glob.glob(img_source + '/*')
-    for file in filelist:
-        _, file_ext = os.path.splitext(file)
-        if file_ext in img_ext_list:
-            imgs_list.append(file)
+if source_type == 'image' or source_type == 'folder':
+    if source_type == 'image':
+        imgs_list = [img_source]
+    else:
+        imgs_list = list_images(img_source, recursive=args.recursive)
+
+    # Images are read and decoded ahead of the model on a thread pool (at reduced scale when --resolution is much smaller than the source)
+    image_loader = PrefetchImageLoader(imgs_list, workers=int(args.prefetch_workers),
+                                       target_size=(resW, resH) if resize else None)
+    image_iter = iter(image_loader)
 elif source_type == 'video' or source_type == 'usb':
 
     if source_type == 'video': cap_arg = img_source
     elif source_type == 'usb': cap_arg = usb_idx
     cap = cv2.VideoCapture(cap_arg)
 
+    # Keep the camera's internal buffer short so captured frames are as fresh as possible
+    if source_type == 'usb':
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
     # Set camera or video resolution if specified by user
     if user_res:
         ret = cap.set(3, resW)
         ret = cap.set(4, resH)
 
+    # Set up recording; frames are encoded on a background thread so a slow disk never stalls the loop.
+    # Video files are recorded losslessly at their own frame rate, cameras drop frames and measure theirs.
+    if record:
+        record_fps = float(args.record_fps) if args.record_fps else None
+        if record_fps is None and source_type == 'video':
+            record_fps = cap.get(cv2.CAP_PROP_FPS) or None
+        recorder = AsyncVideoRecorder(args.record_path, (resW,resH), codec=args.record_codec,
+                                      fps=record_fps,
+                                      queue_size=int(args.record_queue),
+                                      rotate_mb=float(args.record_rotate_mb) if args.record_rotate_mb else None,
+                                      rotate_seconds=float(args.record_rotate_s) if args.record_rotate_s else None,
+                                      lossless=(source_type == 'video'))
+
 elif source_type == 'picamera':
     from picamera2 import Picamera2
     cap = Picamera2()
     cap.configure(cap.create_video_configuration(main={"format": 'RGB888', "size": (resW, resH)}))
     cap.start()
 
-# Set bounding box colors (using the Tableu 10 color scheme)
-bbox_colors = [(164,120,87), (68,148,228), (93,97,209), (178,182,133), (88,159,106), 
-              (96,202,231), (159,124,168), (169,162,241), (98,118,150), (172,176,184)]
+# Warm up the backend so the first frames don't pay for lazy initialization
+if resize:
+    warmup_shape = (resH, resW, 3)
+else:
+    warmup_shape = (model.imgsz, model.imgsz, 3)
+model.warmup(warmup_shape, runs=int(args.warmup), conf=min_thresh)
+
+# Set up per-stage latency tracking (and periodic export, if requested)
+metrics_format = args.metrics_format
+if args.metrics_out and metrics_format is None:
+    metrics_format = 'prom' if args.metrics_out.endswith('.prom') else 'csv'
+profiler = Profiler(stages=['capture','resize','enhance','motion_gate','inference','postprocess','tracking','draw','display','record','output'],
+                    export_path=args.metrics_out, export_format=metrics_format or 'csv', export_interval=float(args.metrics_interval))
+
+# Set up the adaptive resolution controller. The display is only scaled when boxes are drawn: headless records
+# and tracking/line counts are in display pixels and must keep one coordinate frame.
+adaptive = None
+if args.adaptive_latency_ms:
+    adaptive = AdaptiveResolution(float(args.adaptive_latency_ms), [int(s) for s in args.adaptive_sizes.split(',')],
+                                  start_size=model.imgsz, scale_display=not (headless or args.track))
+    print(f'Adaptive resolution: target {float(args.adaptive_latency_ms):.1f} ms per frame, starting at imgsz {adaptive.imgsz}')
+
+# Set up frame enhancement matching the training preprocessing (only used from the capture stage, which owns its buffers)
+enhancer = EnhancementPipeline.training() if args.enhance else None
+
+# Set up region-of-interest cropping
+roi = None
+if args.roi_config:
+    if args.tile:
+        print('Tiled inference covers the whole frame, so it cannot be combined with --roi_config. Please choose one.')
+        sys.exit(0)
+    try:
+        roi_polygons = load_roi_config(args.roi_config, img_source)
+    except (OSError, ValueError) as e:
+        print(f'{e} Please try again.')
+        sys.exit(0)
+    # Regions are given in display pixels; remember that size so they follow the adaptive display scale
+    if resize:
+        roi_base = (resW, resH)
+    elif source_type == 'video' or source_type == 'usb':
+        roi_base = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    else:
+        roi_base = None
+    roi = RoiDetector(model, roi_polygons, mode=args.roi_mode, min_thresh=min_thresh, base_size=roi_base)
+
+# Set up tiled inference
+tiler = None
+if args.tile:
+    tile_size = int(args.tile_size) if args.tile_size else model.imgsz
+    tiler = TiledDetector(model, tile_size, overlap=float(args.tile_overlap), min_thresh=min_thresh,
+                          skip_static=args.tile_skip_static, refresh_every=int(args.refresh_every))
+
+# Set up motion gating, which skips inference on frames where nothing moved
+motion_gate = None
+if args.motion_gate:
+    motion_gate = MotionGate(float(args.motion_gate), int(args.refresh_every), args.motion_method)
+
+# Set up tracking and line-crossing counts
+tracker = None
+line_counter = None
+if args.track:
+    tracker = IouTracker()
+    detect_every = int(args.detect_every)
+    if args.count_line:
+        line_counter = LineCounter(*[float(v) for v in args.count_line.split(',')])
+
+# Set up box and label drawing (label text sizes are cached per class and confidence), or the detection record file in headless mode
+if headless:
+    writer = open_detection_writer(args.output, args.output_format)
+else:
+    annotator = Annotator(labels)
 
 # Initialize control and status variables
 avg_frame_rate = 0
-frame_rate_buffer = []
 fps_avg_len = 200
-img_count = 0
-
-# Begin inference loop
-while True:
-
-    t_start = time.perf_counter()
-
-    # Load frame from image source
-    if source_type == 'image' or source_type == 'folder': # If source is image or image folder, load the image using its filename
-        if img_count >= len(imgs_list):
-            print('All images have been processed. Exiting program.')
-            sys.exit(0)
-        img_filename = imgs_list[img_count]
-        frame = cv2.imread(img_filename)
-        img_count = img_count + 1
-    
-    elif source_type == 'video': # If source is a video, load next frame from video file
-        ret, frame = cap.read()
-        if not ret:
-            print('Reached end of the video file. Exiting program.')
-            break
-    
-    elif source_type == 'usb': # If source is a USB camera, grab frame from camera
-        ret, frame = cap.read()
-        if (frame is None) or (not ret):
-            print('Unable to read frames from the camera. This indicates the camera is disconnected or not working. Exiting program.')
-            break
-
-    elif source_type == 'picamera': # If source is a Picamera, grab frames using picamera interface
-        frame = cap.capture_array()
-        if (frame is None):
-            print('Unable to read frames from the Picamera. This indicates the camera is disconnected or not working. Exiting program.')
+frame_rate_window = RollingWindow(fps_avg_len)
+frames_read = 0
+last_detections = None
+frames_tracked = 0
+
+def grab_frame():
+    """Load the next frame from the image source as a (frame index, frame) pair, or return None when the source is exhausted."""
+    global frames_read
+
+    with profiler.stage('capture'):
+        if source_type == 'image' or source_type == 'folder': # If source is image or image folder, load the image using its filename
+            while True:
+                item = next(image_iter, None)
+                if item is None:
+                    print('All images have been processed. Exiting program.')
+                    return None
+                img_filename, frame = item
+                if frame is not None:
+                    break
+                print(f'Unable to read image {img_filename}, skipping it.')
+                frames_read = frames_read + 1 # Keep frame indices aligned with imgs_list
+
+        elif source_type == 'video': # If source is a video, load next frame from video file
+            ret, frame = cap.read()
+            if not ret:
+                print('Reached end of the video file. Exiting program.')
+                return None
+
+        elif source_type == 'usb': # If source is a USB camera, grab frame from camera
+            ret, frame = cap.read()
+            if (frame is None) or (not ret):
+                print('Unable to read frames from the camera. This indicates the camera is disconnected or not working. Exiting program.')
+                return None
+
+        elif source_type == 'picamera': # If source is a Picamera, grab frames using picamera interface
+            frame = cap.capture_array()
+            if (frame is None):
+                print('Unable to read frames from the Picamera. This indicates the camera is disconnected or not working. Exiting program.')
+                return None
+
+    # Resize frame to desired display resolution (scaled down further by the adaptive controller when it needs to)
+    if adaptive is not None and adaptive.display_scale < 1:
+        base_w, base_h = (resW, resH) if resize else (frame.shape[1], frame.shape[0])
+        with profiler.stage('resize'):
+            frame = cv2.resize(frame,(int(base_w*adaptive.display_scale), int(base_h*adaptive.display_scale)))
+    elif resize == True:
+        with profiler.stage('resize'):
+            frame = cv2.resize(frame,(resW,resH))
+
+    # Enhance the frame in place the way the training images were
+    if enhancer is not None:
+        with profiler.stage('enhance'):
+            frame = enhancer(frame)
+
+    frame_idx = frames_read
+    frames_read = frames_read + 1
+    return frame_idx, frame
+
+def grab_batch(size):
+    """Collect up to size (frame index, frame) pairs."""
+    batch = []
+    while len(batch) < size:
+        item = grab_frame()
+        if item is None:
             break
+        batch.append(item)
+    return batch
 
-    # Resize frame to desired display resolution
-    if resize == True:
-        frame = cv2.resize(frame,(resW,resH))
-
-    # Run inference on frame
-    results = model(frame, verbose=False)
-
-    # Extract results
-    detections = results[0].boxes
-
-    # Initialize variable for basic object counting example
-    object_count = 0
-
-    # Go through each detection and get bbox coords, confidence, and class
-    for i in range(len(detections)):
-
-        # Get bounding box coordinates
-        # Ultralytics returns results in Tensor format, which have to be converted to a regular Python array
-        xyxy_tensor = detections[i].xyxy.cpu() # Detections in Tensor format in CPU memory
-        xyxy = xyxy_tensor.numpy().squeeze() # Convert tensors to Numpy array
-        xmin, ymin, xmax, ymax = xyxy.astype(int) # Extract individual coordinates and convert to int
-
-        # Get bounding box class ID and name
-        classidx = int(detections[i].cls.item())
-        classname = labels[classidx]
-
-        # Get bounding box confidence
-        conf = detections[i].conf.item()
+def source_name(frame_idx):
+    """Return the file a frame was loaded from (image sources only)."""
+    if source_type == 'image' or source_type == 'folder':
+        return imgs_list[frame_idx]
+    return None
+
+def run_inference(frame):
+    """Run the model on a single frame and return its detections above the confidence threshold."""
+    if tiler is not None:
+        with profiler.stage('inference'): # Tiling does its own merging, so it is all counted as inference
+            return tiler(frame)
+    size = {'imgsz': adaptive.imgsz} if adaptive is not None else {}
+    if roi is not None:
+        with profiler.stage('inference'): # Crop offsets and the region filter are cheap, so it is all counted as inference
+            return roi(frame, **size)
+    with profiler.stage('inference'):
+        results = model(frame, conf=min_thresh, verbose=False, **size)
+    with profiler.stage('postprocess'):
+        return extract_detections(results[0].boxes, min_thresh)
+
+def run_inference_batch(frames):
+    """Run the model on a list of frames in one forward pass. Detections come back in the same order as the frames."""
+    if tiler is not None:
+        # Each frame is already a batch of tiles
+        with profiler.stage('inference'):
+            return [tiler(frame) for frame in frames]
+    if roi is not None:
+        with profiler.stage('inference'):
+            return [roi(frame) for frame in frames]
+    with profiler.stage('inference'):
+        results = model(frames, conf=min_thresh, verbose=False)
+    with profiler.stage('postprocess'):
+        return [extract_detections(result.boxes, min_thresh) for result in results]
+
+def detect(frame):
+    """Run inference on a frame, or reuse the last detections if the motion gate finds the frame static."""
+    global last_detections
+
+    if motion_gate is not None:
+        with profiler.stage('motion_gate'):
+            static = not motion_gate.should_infer(frame)
+        if static:
+            return last_detections
+
+    t_infer = time.perf_counter()
+    last_detections = run_inference(frame)
+    if motion_gate is not None:
+        motion_gate.record_inference(time.perf_counter() - t_infer)
+    return last_detections
+
+def detect_and_track(frame):
+    """Run the detector every detect_every frames, follow boxes with the tracker in between and update the line counts."""
+    global frames_tracked
+
+    detections = run_inference(frame) if frames_tracked % detect_every == 0 else None
+    frames_tracked = frames_tracked + 1
+
+    with profiler.stage('tracking'):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        tracked = tracker.update(gray, detections)
+        if line_counter is not None:
+            line_counter.update(tracked)
+            if detections is not None:
+                line_counter.forget(tracker.ids)
+    return tracked
+
+def detect_batch(frames):
+    """Batched version of detect(): only frames that pass the motion gate go through the model, static frames reuse the detections before them."""
+    global last_detections
+
+    if motion_gate is None:
+        return run_inference_batch(frames)
+
+    with profiler.stage('motion_gate'):
+        run_mask = [motion_gate.should_infer(frame) for frame in frames]
+    t_infer = time.perf_counter()
+    inferred = iter(run_inference_batch([frame for frame, run in zip(frames, run_mask) if run]))
+    if any(run_mask):
+        motion_gate.record_inference(time.perf_counter() - t_infer, frames=sum(run_mask))
+
+    batch_detections = []
+    for run in run_mask:
+        if run:
+            last_detections = next(inferred)
+        batch_detections.append(last_detections)
+    return batch_detections
+
+def draw_detections(frame, detections):
+    """Draw boxes and labels on the frame and return the number of objects drawn."""
+    with profiler.stage('draw'):
+        return annotator.draw(frame, detections)
+
+def draw_status(frame, object_count):
+    """Draw the framerate and object count overlay."""
 
-        # Draw box if confidence threshold is high enough
-        if conf > 0.5:
+    # Calculate and draw framerate (if using video, USB, or Picamera source)
+    if source_type == 'video' or source_type == 'usb' or source_type == 'picamera':
+        cv2.putText(frame, f'FPS: {avg_frame_rate:0.2f}', (10,20), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2) # Draw framerate
 
-            color = bbox_colors[classidx % 10]
-            cv2.rectangle(frame, (xmin,ymin), (xmax,ymax), color, 2)
+    cv2.putText(frame, f'Number of objects: {object_count}', (10,40), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2) # Draw total number of detected objects
 
-            label = f'{classname}: {int(conf*100)}%'
-            labelSize, baseLine = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1) # Get font size
-            label_ymin = max(ymin, labelSize[1] + 10) # Make sure not to draw label too close to top of window
-            cv2.rectangle(frame, (xmin, label_ymin-labelSize[1]-10), (xmin+labelSize[0], label_ymin+baseLine-10), color, cv2.FILLED) # Draw white box to put label text in
-            cv2.putText(frame, label, (xmin, label_ymin-7), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1) # Draw label text
+    # Draw the counting line and the crossing counts
+    if line_counter is not None:
+        line_counter.draw(frame)
 
-            # Basic example: count the number of objects in the image
-            object_count = object_count + 1
+def show_results(frame, object_count):
+    """Display and record the annotated frame, handle keypresses. Returns False when the user quits."""
 
-    # Calculate and draw framerate (if using video, USB, or Picamera source)
-    if source_type == 'video' or source_type == 'usb' or source_type == 'picamera':
-        cv2.putText(frame, f'FPS: {avg_frame_rate:0.2f}', (10,20), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2) # Draw framerate
-    
     # Display detection results
-    cv2.putText(frame, f'Number of objects: {object_count}', (10,40), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2) # Draw total number of detected objects
-    cv2.imshow('YOLO detection results',frame) # Display image
-    if record: recorder.write(frame)
+    with profiler.stage('draw'):
+        draw_status(frame, object_count)
+    with profiler.stage('display'):
+        cv2.imshow('YOLO detection results',frame) # Display image
+    if record:
+        with profiler.stage('record'):
+            recorder.write(frame)
 
     # If inferencing on individual images, wait for user keypress before moving to next image. Otherwise, wait 5ms before moving to next frame.
     if source_type == 'image' or source_type == 'folder':
         key = cv2.waitKey()
     elif source_type == 'video' or source_type == 'usb' or source_type == 'picamera':
-        key = cv2.waitKey(5)
-    
+        with profiler.stage('display'):
+            key = cv2.waitKey(5)
+
     if key == ord('q') or key == ord('Q'): # Press 'q' to quit
-        break
+        return False
     elif key == ord('s') or key == ord('S'): # Press 's' to pause inference
         cv2.waitKey()
     elif key == ord('p') or key == ord('P'): # Press 'p' to save a picture of results on this frame
         cv2.imwrite('capture.png',frame)
-    
-    # Calculate FPS for this frame
-    t_stop = time.perf_counter()
-    frame_rate_calc = float(1/(t_stop - t_start))
-
-    # Append FPS result to frame_rate_buffer (for finding average FPS over multiple frames)
-    if len(frame_rate_buffer) >= fps_avg_len:
-        temp = frame_rate_buffer.pop(0)
-        frame_rate_buffer.append(frame_rate_calc)
-    else:
-        frame_rate_buffer.append(frame_rate_calc)
+    return True
+
+def publish_results(frame_idx, frame, detections):
+    """Draw, display and record one frame's results, or write them to the record file in headless mode. Returns False when the user quits."""
+    if headless:
+        with profiler.stage('output'):
+            writer.write(time.time(), frame_idx, detections, source=source_name(frame_idx))
+        return True
 
-    # Calculate average FPS for past frames
-    avg_frame_rate = np.mean(frame_rate_buffer)
+    object_count = draw_detections(frame, detections)
+    return show_results(frame, object_count)
 
+def update_frame_rate(frame_time):
+    """Add one frame time (in seconds) to frame_rate_window and refresh the average FPS."""
+    global avg_frame_rate
+
+    frame_rate_calc = float(1/frame_time)
+
+    # Add FPS result to the rolling window and read the average FPS over the past fps_avg_len frames (constant time per frame)
+    frame_rate_window.add(frame_rate_calc)
+    avg_frame_rate = frame_rate_window.mean
+
+    # Export stage latencies if it is time to
+    profiler.maybe_export()
+
+# Ctrl-C and SIGTERM (how headless runs get stopped) end the loop normally, so the cleanup below always runs
+def handle_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+signal.signal(signal.SIGTERM, handle_sigterm)
+
+# Begin inference loop
+try:
+    if pipelined:
+
+        # Capture and inference run on their own threads; display and recording stay on the main thread.
+        # Live cameras drop stale frames so the newest one is always processed, video files are processed losslessly.
+        pipeline = DetectionPipeline(grab_frame, detect_and_track if tracker is not None else detect, drop_frames=(source_type != 'video'))
+        pipeline.start()
+
+        latency_sum = 0
+        frame_count = 0
+        t_last = time.perf_counter()
+        try:
+            for frame_idx, frame, detections, t_capture in pipeline:
+                keep_running = publish_results(frame_idx, frame, detections)
+
+                # Track output frame rate and capture-to-display latency
+                t_stop = time.perf_counter()
+                update_frame_rate(t_stop - t_last)
+                t_last = t_stop
+                latency_sum = latency_sum + (t_stop - t_capture)
+                if adaptive is not None:
+                    adaptive.update(t_stop - t_capture)
+                frame_count = frame_count + 1
+
+                if not keep_running:
+                    break
+        finally:
+            pipeline.stop()
+        if frame_count > 0:
+            print(f'Average capture-to-display latency: {latency_sum/frame_count*1000:.1f} ms')
+        print(f'Frames dropped to stay on the latest frame: {pipeline.dropped}')
+
+    elif batch_size:
+
+        # Non-interactive: group frames into one forward pass, then map each result back to its file or frame index
+        if (source_type == 'image' or source_type == 'folder') and not headless:
+            os.makedirs(save_dir, exist_ok=True)
+
+        frames_done = 0
+        t_begin = time.perf_counter()
+        while True:
+
+            batch = grab_batch(batch_size)
+            if not batch:
+                break
+
+            t_start = time.perf_counter()
+            batch_detections = detect_batch([frame for _, frame in batch])
+
+            for (frame_idx, frame), detections in zip(batch, batch_detections):
+                if headless:
+                    with profiler.stage('output'):
+                        writer.write(time.time(), frame_idx, detections, source=source_name(frame_idx))
+                    continue
+                object_count = draw_detections(frame, detections)
+                with profiler.stage('draw'):
+                    draw_status(frame, object_count)
+                if source_type == 'image' or source_type == 'folder':
+                    img_filename = source_name(frame_idx)
+                    # Keep the subfolder layout so same-named images from different subfolders (--recursive) don't overwrite each other
+                    rel_path = os.path.relpath(img_filename, img_source) if source_type == 'folder' else os.path.basename(img_filename)
+                    out_path = os.path.join(save_dir, rel_path)
+                    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                    cv2.imwrite(out_path, frame)
+                    print(f'{img_filename}: {object_count} objects')
+                elif record:
+                    with profiler.stage('record'):
+                        recorder.write(frame)
+
+            # Spread the batch time over its frames so the FPS stays comparable to the single-frame loop
+            t_stop = time.perf_counter()
+            update_frame_rate((t_stop - t_start) / len(batch))
+            frames_done = frames_done + len(batch)
+
+        t_total = time.perf_counter() - t_begin
+        print(f'Processed {frames_done} frames in {t_total:.2f} s ({frames_done/max(t_total, 1e-9):.2f} frames/s overall).')
+        if (source_type == 'image' or source_type == 'folder') and not headless:
+            print(f'Annotated images saved to {save_dir}')
+
+    else:
+        while True:
+
+            t_start = time.perf_counter()
+
+            # Load frame from image source
+            item = grab_frame()
+            if item is None:
+                break
+            frame_idx, frame = item
+
+            # Run inference on frame (unless the motion gate skips it), or track objects between detection frames
+            if tracker is not None:
+                detections = detect_and_track(frame)
+            else:
+                detections = detect(frame)
+
+            # Draw, display and record results (or write them out in headless mode)
+            if not publish_results(frame_idx, frame, detections):
+                break
+
+            # Calculate FPS for this frame
+            t_stop = time.perf_counter()
+            update_frame_rate(t_stop - t_start)
+            if adaptive is not None:
+                adaptive.update(t_stop - t_start)
+except KeyboardInterrupt:
+    print('Interrupted, stopping.')
 
 # Clean up
 print(f'Average pipeline FPS: {avg_frame_rate:.2f}')
+if roi is not None:
+    print(f'Regions of interest: {roi.pixel_fraction*100:.1f}% of frame pixels went through the model')
+if tiler is not None:
+    print(f'Tiles run: {tiler.tiles_run}, tiles reused because nothing moved: {tiler.tiles_skipped}')
+if line_counter is not None:
+    print(f'Line crossings: {line_counter.count_in} in, {line_counter.count_out} out')
+if tracker is not None:
+    print(f'Tracks started: {tracker.tracks_started}, detector ran on {(frames_tracked + detect_every - 1) // detect_every} of {frames_tracked} frames')
+if motion_gate is not None:
+    gate_stats = motion_gate.summary()
+    print(f'Motion gate skipped {gate_stats["skipped"]} of {gate_stats["frames"]} frames ({gate_stats["skip_ratio"]*100:.1f}%), saving about {gate_stats["time_saved_s"]:.2f} s of inference.')
+if adaptive is not None:
+    print(adaptive.summary())
+print_backend_comparison(record_backend_stats(model, args.backend_stats))
+profiler.export()
+if args.profile:
+    profiler.print_summary()
 if source_type == 'video' or source_type == 'usb':
     cap.release()
 elif source_type == 'picamera':
     cap.stop()
-if record: recorder.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+if record:
+    recorder.release()
+    print(recorder.summary())
+if headless:
+    writer.close()
+    print(f'Wrote detections for {writer.frames_written} frames to {args.output}')
+elif not batch_size:
+    # Batched mode never opens a window (and opencv-headless builds raise here)
+    cv2.destroyAllWindows()
+
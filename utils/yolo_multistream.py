@@ -0,0 +1,174 @@
+import os
+import sys
+import argparse
+import signal
+import threading
+import time
+
+import cv2
+
+from detect_backends import DetectorBackend, print_backend_comparison, record_backend_stats
+from detect_multistream import StreamMultiplexer, StreamReader, StreamSink
+from detect_postprocess import Annotator, extract_detections
+from detect_output import open_detection_writer
+from video_recorder import AsyncVideoRecorder
+
+# Define and parse user input arguments
+
+parser = argparse.ArgumentParser(description='Run one YOLO model over several cameras or videos at once, batching frames across streams.')
+parser.add_argument('--model', help='Path to YOLO model file (example: "my_model/my_model.pt")',
+                    required=True)
+parser.add_argument('--sources', help='List of sources: USB camera indices ("usb0"), video files ("assets/video1.mp4") or stream URLs ("rtsp://...")',
+                    nargs='+', required=True)
+parser.add_argument('--thresh', help='Minimum confidence threshold for displaying detected objects (example: "0.4")',
+                    default=0.5)
+parser.add_argument('--resolution', help='Resolution in WxH that every stream is resized to (example: "640x480"). Required to record.',
+                    default=None)
+parser.add_argument('--batch', help='Maximum number of frames per forward pass (default: number of sources)',
+                    default=None)
+parser.add_argument('--record', help='Record each stream to "<stream>_<index>.avi". Must specify --resolution argument to record.',
+                    action='store_true')
+parser.add_argument('--headless', help='Skip all drawing and GUI calls and write detections of every stream to --output',
+                    action='store_true')
+parser.add_argument('--output', help='Detection record file written in --headless mode (default: "detections.jsonl")',
+                    default='detections.jsonl')
+parser.add_argument('--backend', help='Inference backend: "torch" runs the .pt weights, "onnx" and "openvino" export them once next to the weights and run the export on CPU',
+                    choices=['torch', 'onnx', 'openvino'], default='torch')
+parser.add_argument('--threads', help='Number of intra-op CPU threads for the inference backend (example: "4")',
+                    default=None)
+parser.add_argument('--interop_threads', help='Number of inter-op threads (torch, onnx) or inference streams (openvino) for the backend',
+                    default=None)
+parser.add_argument('--backend_stats', help='JSON file where this run\'s backend latency is stored, to compare backends across runs on this host (example: "backend_stats.json"). \
+                    Not written by default.',
+                    default=None)
+parser.add_argument('--warmup', help='Number of warm-up forward passes to run before the loop starts (default: 2)',
+                    default=2)
+
+args = parser.parse_args()
+
+model_path = args.model
+min_thresh = float(args.thresh)
+user_res = args.resolution
+record = args.record
+headless = args.headless
+
+# Check if model file exists and is valid
+if (not os.path.exists(model_path)):
+    print('ERROR: Model path is invalid or model was not found. Make sure the model filename was entered correctly.')
+    sys.exit(0)
+
+resolution = None
+if user_res:
+    resolution = (int(user_res.split('x')[0]), int(user_res.split('x')[1]))
+
+if record and not resolution:
+    print('Please specify resolution to record video at.')
+    sys.exit(0)
+if record and headless:
+    print('Recording needs the drawn frames, so it cannot be combined with headless mode. Please choose one.')
+    sys.exit(0)
+
+# Load the model once for all streams, on the chosen backend
+model = DetectorBackend(model_path, args.backend,
+                        threads=int(args.threads) if args.threads else None,
+                        interop_threads=int(args.interop_threads) if args.interop_threads else None)
+labels = model.names
+if resolution:
+    warmup_shape = (resolution[1], resolution[0], 3)
+else:
+    warmup_shape = (model.imgsz, model.imgsz, 3)
+model.warmup(warmup_shape, runs=int(args.warmup), conf=min_thresh)
+
+# Open every source on its own reader thread, with one sink (window, recorder, counters) per stream
+stop_event = threading.Event()
+readers = []
+sinks = []
+for stream_id, source in enumerate(args.sources):
+    try:
+        reader = StreamReader(stream_id, source, stop_event, resolution)
+    except ValueError as e:
+        print(f'{e} Please try again.')
+        sys.exit(0)
+    readers.append(reader)
+
+    recorder = None
+    if record:
+        stem = os.path.splitext(os.path.basename(source))[0] or 'stream'
+        # Video files keep every frame at their own frame rate; live streams drop frames and measure theirs
+        fps = None if reader.live else (reader.cap.get(cv2.CAP_PROP_FPS) or None)
+        recorder = AsyncVideoRecorder(f'{stem}_{stream_id}.avi', resolution, fps=fps, lossless=not reader.live)
+    sinks.append(StreamSink(stream_id, source, recorder))
+
+max_batch = int(args.batch) if args.batch else len(readers)
+multiplexer = StreamMultiplexer(readers, max_batch)
+
+if headless:
+    writer = open_detection_writer(args.output)
+else:
+    annotator = Annotator(labels)
+
+for reader in readers:
+    reader.start()
+
+# Ctrl-C and SIGTERM (how headless runs get stopped) end the loop normally, so the cleanup below always runs
+def handle_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+signal.signal(signal.SIGTERM, handle_sigterm)
+
+# Begin inference loop: one forward pass per batch, results fanned back out to their streams
+batches = 0
+frames_done = 0
+t_begin = time.perf_counter()
+keep_running = True
+try:
+    while keep_running:
+
+        batch = multiplexer.next_batch()
+        if not batch:
+            break
+
+        results = model([frame for _, _, frame in batch], conf=min_thresh, verbose=False)
+        batches = batches + 1
+        frames_done = frames_done + len(batch)
+
+        for (stream_id, frame_idx, frame), result in zip(batch, results):
+            detections = extract_detections(result.boxes, min_thresh)
+            sink = sinks[stream_id]
+            sink.update(len(detections))
+
+            if headless:
+                writer.write(time.time(), frame_idx, detections, source=sink.source)
+                continue
+
+            annotator.draw(frame, detections)
+            cv2.putText(frame, f'FPS: {sink.frame_rate:0.2f}', (10,20), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2) # Draw framerate
+            cv2.putText(frame, f'Number of objects: {len(detections)}', (10,40), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2) # Draw total number of detected objects
+            cv2.imshow(sink.window_name, frame)
+            if sink.recorder is not None: sink.recorder.write(frame)
+
+        if not headless:
+            key = cv2.waitKey(1)
+            if key == ord('q') or key == ord('Q'): # Press 'q' to quit
+                keep_running = False
+except KeyboardInterrupt:
+    print('Interrupted, stopping.')
+
+# Clean up
+stop_event.set()
+for reader in readers:
+    reader.join()
+for sink in sinks:
+    sink.close()
+
+t_total = time.perf_counter() - t_begin
+print(f'Processed {frames_done} frames in {batches} batches ({frames_done/max(batches, 1):.2f} frames per batch, {frames_done/max(t_total, 1e-9):.2f} frames/s overall).')
+for sink in sinks:
+    print(f'Stream {sink.stream_id} ({sink.source}): {sink.frames} frames, {sink.frame_rate:.2f} FPS, {sink.objects} objects detected')
+print_backend_comparison(record_backend_stats(model, args.backend_stats))
+
+if headless:
+    writer.close()
+    print(f'Wrote detections for {writer.frames_written} frames to {args.output}')
+else:
+    cv2.destroyAllWindows()